@@ -1,8 +1,35 @@
+from optparse import OptionParser
 from manager import AnalysisManager
 import warnings
 # ignore matplotlib warnings
 warnings.filterwarnings("ignore")
 
-analyzer = AnalysisManager()
-analyzer.make_plots()
-analyzer.plot_single_nodes()
+
+def main(arguments=None):
+    """
+    Analyses the results of the simulations and creates the plots or, when
+    requested, reports the variance reduction between two settings
+    :param arguments: command line arguments, None to use the ones of the
+    process
+    """
+    parser = OptionParser(usage="usage: %prog [options]",
+                          description="Analyses the results of the simulations and creates the plots")
+    parser.add_option("-d", "--data-folder", dest="data_folder", default="raw_data/", action="store",
+                      help="folder with one sub folder of output files per setting [default: %default]")
+    parser.add_option("--variance-reduction", dest="variance_reduction", default=None, action="store", nargs=2,
+                      metavar="FOLDER_A FOLDER_B",
+                      help="instead of plotting, report the variance reduction of the throughput achieved by "
+                           "common random numbers between the settings in the sub folders FOLDER_A and FOLDER_B, "
+                           "and by antithetic pairs of runs within each of them")
+    (options, args) = parser.parse_args(arguments)
+
+    analyzer = AnalysisManager(options.data_folder)
+    if options.variance_reduction is not None:
+        analyzer.print_variance_reduction(*options.variance_reduction)
+    else:
+        analyzer.make_plots()
+        analyzer.plot_single_nodes()
+
+
+if __name__ == "__main__":
+    main()
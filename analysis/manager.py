@@ -1,5 +1,5 @@
 from plot import Plotter, SingleNodePlotter
-from simulation_analysis import SimulationGroupFolder
+from simulation_analysis import SimulationGroupFolder, common_random_numbers_reduction, antithetic_reduction
 
 
 class AnalysisManager:
@@ -68,6 +68,25 @@ class AnalysisManager:
             nodes.append(NodeResult(i + 1, loads, throughputs, coll_rate, drop_rate, corr_rate))
         return nodes
 
+    def print_variance_reduction(self, folder_a, folder_b, metric="throughput"):
+        """
+        Prints the variance reduction achieved by common random numbers when
+        comparing two settings, and by antithetic pairs of runs within each
+        setting, if any. Inter-arrival times with less than two replications
+        are not reported
+        :param folder_a: sub folder of the first setting
+        :param folder_b: sub folder of the second setting
+        :param metric: name of the SingleSimulation method computing the metric
+        """
+        print("Variance reduction of %s, %s vs %s" % (metric, folder_a, folder_b))
+        crn = common_random_numbers_reduction(self.base_folder + folder_a, self.base_folder + folder_b, metric)
+        for k in sorted(crn.keys()):
+            print("Common random numbers: %s" % str(crn[k]))
+        for folder in (folder_a, folder_b):
+            antithetic = antithetic_reduction(self.base_folder + folder, metric)
+            for k in sorted(antithetic.keys()):
+                print("Antithetic pairs, %s: %s" % (folder, str(antithetic[k])))
+
     def make_plots(self):
         """
         One only comparison between disk and prob reception, made on throughput
@@ -1,9 +1,66 @@
+import math
 import os
+import statistics
 import pandas as pd
 
 from simulator.log import Log
 
 
+def parse_file_name(file_name):
+    """
+    Parses the name of an output file, in the format
+    output_{lambda}_{seed}.csv, or output_{lambda}_{seed}_{antithetic}.csv for
+    the antithetic pairs of runs
+    :param file_name: the name of the file
+    :return: a tuple (inter-arrival, seed, antithetic), where antithetic is
+    True for the antithetic run of a pair
+    """
+    info = os.path.splitext(file_name)[0].split("_")
+    antithetic = len(info) > 3 and int(info[3]) != 0
+    return int(info[1]), int(info[2]), antithetic
+
+
+def read_output(file_path):
+    """
+    Reads the output file of a simulation. Files written with importance
+    sampling have a log_weight column, with the log likelihood ratio of each
+    event: a weight column is added with its exponential
+    :param file_path: path of the file
+    :return: the data frame
+    """
+    df = pd.read_csv(file_path)
+    if "log_weight" in df.columns:
+        df["weight"] = df["log_weight"].map(math.exp)
+    return df
+
+
+def count_events(df, event):
+    """
+    Counts the events of a type. With importance sampling, each event counts
+    as its weight, so that the count is an unbiased estimate of the number
+    of events under the nominal distributions
+    :param df: the data frame of the simulation, or part of it
+    :param event: the type of event
+    :return: the (weighted) number of events
+    """
+    rows = df.loc[df["event"] == event]
+    if "weight" in df.columns:
+        return rows["weight"].sum()
+    return len(rows)
+
+
+def received_bytes(df):
+    """
+    Sums the sizes of the received packets, weighted as in count_events()
+    :param df: the data frame of the simulation, or part of it
+    :return: the (weighted) number of received bytes
+    """
+    rows = df.loc[df["event"] == Log.LOG_RECEIVED]
+    if "weight" in df.columns:
+        return (rows["size"] * rows["weight"]).sum()
+    return rows["size"].sum()
+
+
 class SimulationGroupFolder:
     """
     Handle a series of simulations.
@@ -30,7 +87,8 @@ class SimulationGroupFolder:
     def group_by_inter_arrival(self, file_list):
         """
         Group all the simulations in a list of files by seeds, computing the average of load, throughput, drop rate and
-        collision rate
+        collision rate. The events of simulations run with importance sampling are weighted by their likelihood
+        ratio, so that the metrics estimate the ones of the nominal distributions
         :param file_list: the list of simulation result files to be grouped
         :return: a dict, with keys the inter-arrival time, and values a list of SimulationGroupResult
         """
@@ -43,8 +101,9 @@ class SimulationGroupFolder:
             # inter arrival
             if single_simulation.inter_arrival not in inter_arrival_group:
                 inter_arrival_group[single_simulation.inter_arrival] = {}
-            # seed
-            inter_arrival_group[single_simulation.inter_arrival][single_simulation.seed] = single_simulation
+            # seed, and whether the run is the antithetic of the seed
+            inter_arrival_group[single_simulation.inter_arrival][single_simulation.replication()] = \
+                single_simulation
         # create and fill a dictionary, with keys the inter-arrival times,
         # and values the aggregation over seeds of the simulations
         group_results = {}
@@ -77,8 +136,9 @@ class SimulationGroupFolder:
             # inter arrival
             if single_simulation.inter_arrival not in inter_arrival_group:
                 inter_arrival_group[single_simulation.inter_arrival] = {}
-            # seed
-            inter_arrival_group[single_simulation.inter_arrival][single_simulation.seed] = single_simulation
+            # seed, and whether the run is the antithetic of the seed
+            inter_arrival_group[single_simulation.inter_arrival][single_simulation.replication()] = \
+                single_simulation
         # create and fill a dictionary, with keys the inter-arrival times,
         # and values the aggregation over seeds of the simulations
         group_results = {}
@@ -111,6 +171,109 @@ class SimulationGroupFolder:
                 )
         return group_results
 
+    def metric_by_replication(self, file_list, metric):
+        """
+        Computes a metric for every simulation in a list of files
+        :param file_list: the list of simulation result files
+        :param metric: name of the SingleSimulation method computing the
+        metric, e.g., 'throughput'
+        :return: a dict, with keys the inter-arrival time, and values a dict
+        from (seed, antithetic) to the value of the metric
+        """
+        values = {}
+        for file_name in file_list:
+            single_simulation = SingleSimulation(self.folder_path, file_name)
+            values.setdefault(single_simulation.inter_arrival, {})[single_simulation.replication()] = \
+                getattr(single_simulation, metric)()
+        return values
+
+
+class VarianceReduction:
+    """
+    Variance of an estimator with and without a variance reduction technique,
+    for a given inter-arrival time. The ratio between the two is the factor by
+    which the number of replications can be cut for the same precision
+    """
+    def __init__(self, inter_arrival, replications, naive_variance, variance):
+        self.inter_arrival = inter_arrival
+        self.replications = replications
+        self.naive_variance = naive_variance
+        self.variance = variance
+
+    def ratio(self):
+        """
+        Variance without the technique over variance with it
+        :return: the ratio, infinite if the variance is zero
+        """
+        if self.variance == 0:
+            return float("inf")
+        return self.naive_variance / self.variance
+
+    def __repr__(self):
+        return "(Inter-arrival: %s, replications: %d, naive variance: %s, variance: %s, reduction: %.2fx)" % \
+               (str(self.inter_arrival), self.replications, str(self.naive_variance), str(self.variance),
+                self.ratio())
+
+
+def common_random_numbers_reduction(folder_a, folder_b, metric="throughput"):
+    """
+    Measures the variance reduction achieved by common random numbers when
+    comparing two settings, e.g., two protocols simulated with the same seeds
+    and the common_random_numbers option. The variance of the difference of
+    the paired runs is compared with the variance it would have with
+    independent runs, which is the sum of the two variances
+    :param folder_a: folder of the first setting
+    :param folder_b: folder of the second setting
+    :param metric: name of the SingleSimulation method computing the metric
+    :return: a dict, with keys the inter-arrival time, and values a
+    VarianceReduction. Inter-arrival times with less than two pairs of runs are
+    skipped
+    """
+    group_a = SimulationGroupFolder(folder_a)
+    group_b = SimulationGroupFolder(folder_b)
+    values_a = group_a.metric_by_replication(group_a.get_file_list(), metric)
+    values_b = group_b.metric_by_replication(group_b.get_file_list(), metric)
+    results = {}
+    for inter_arrival in values_a:
+        runs_a = values_a[inter_arrival]
+        runs_b = values_b.get(inter_arrival, {})
+        # only the runs simulated in both settings can be paired
+        paired = sorted(r for r in runs_a if r in runs_b)
+        if len(paired) < 2:
+            continue
+        a = [runs_a[r] for r in paired]
+        b = [runs_b[r] for r in paired]
+        naive = statistics.variance(a) + statistics.variance(b)
+        paired_variance = statistics.variance([x - y for x, y in zip(a, b)])
+        results[inter_arrival] = VarianceReduction(inter_arrival, len(paired), naive, paired_variance)
+    return results
+
+
+def antithetic_reduction(folder, metric="throughput"):
+    """
+    Measures the variance reduction achieved by antithetic pairs of runs,
+    simulated with antithetic = [0, 1]. The variance of the mean of each pair
+    is compared with the variance of the mean of two independent runs, which
+    is half the variance of a single run
+    :param folder: folder of the setting
+    :param metric: name of the SingleSimulation method computing the metric
+    :return: a dict, with keys the inter-arrival time, and values a
+    VarianceReduction. Inter-arrival times with less than two complete pairs
+    are skipped
+    """
+    group = SimulationGroupFolder(folder)
+    values = group.metric_by_replication(group.get_file_list(), metric)
+    results = {}
+    for inter_arrival, runs in values.items():
+        seeds = sorted(seed for seed, antithetic in runs if not antithetic and (seed, True) in runs)
+        if len(seeds) < 2:
+            continue
+        singles = [runs[(s, False)] for s in seeds] + [runs[(s, True)] for s in seeds]
+        pairs = [(runs[(s, False)] + runs[(s, True)]) / 2 for s in seeds]
+        naive = statistics.variance(singles) / 2
+        results[inter_arrival] = VarianceReduction(inter_arrival, len(seeds), naive, statistics.variance(pairs))
+    return results
+
 
 class SingleSimulation:
     """
@@ -122,20 +285,26 @@ class SingleSimulation:
         if not self.folder_path.endswith("/"):
             self.folder_path += "/"
         self.file_name = file_name
-        info = self.file_name.split("_")
-        seed_format = info[2].split(".")
-        self.inter_arrival = int(info[1])
-        self.seed = int(seed_format[0])
-        df = pd.read_csv(self.folder_path + self.file_name)
+        self.inter_arrival, self.seed, self.antithetic = parse_file_name(self.file_name)
+        df = read_output(self.folder_path + self.file_name)
         # pre compute all the information needed for the evaluation
         self._n = len(df['dst'].unique())
         self._simulation_time = max(df['time'])
-        self._received = df.loc[df["event"] == Log.LOG_RECEIVED]
-        self._corrupted = len(df.loc[df["event"] == Log.LOG_CORRUPTED])
-        self._corrupted_by_channel = len(df.loc[df["event"] == Log.LOG_CORRUPTED_BY_CHANNEL])
-        self._dropped = len(df.loc[df["event"] == Log.LOG_QUEUE_DROPPED])
-        self._generated = len(df.loc[df["event"] == Log.LOG_GENERATED])
-        self._incoming = len(self._received) + self._corrupted + self._corrupted_by_channel
+        self._received = count_events(df, Log.LOG_RECEIVED)
+        self._received_bytes = received_bytes(df)
+        self._corrupted = count_events(df, Log.LOG_CORRUPTED)
+        self._corrupted_by_channel = count_events(df, Log.LOG_CORRUPTED_BY_CHANNEL)
+        self._dropped = count_events(df, Log.LOG_QUEUE_DROPPED)
+        self._generated = count_events(df, Log.LOG_GENERATED)
+        self._incoming = self._received + self._corrupted + self._corrupted_by_channel
+
+    def replication(self):
+        """
+        Identifies the replication among the simulations with the same
+        inter-arrival time
+        :return: the tuple (seed, antithetic)
+        """
+        return self.seed, self.antithetic
 
     def offered_load(self):
         """
@@ -150,7 +319,7 @@ class SingleSimulation:
         Compute the throughput at the receiver
         :return: the throughput, in Mbps
         """
-        return self._received["size"].sum() * 8 / self._simulation_time / 1024 / 1024
+        return self._received_bytes * 8 / self._simulation_time / 1024 / 1024
 
     def collision_rate(self):
         """
@@ -201,19 +370,20 @@ class NodeData:
 
     def __init__(self, df, simulation_time):
         self.simulation_time = simulation_time
-        self._received = df.loc[df["event"] == Log.LOG_RECEIVED]
-        self._corrupted = len(df.loc[df["event"] == Log.LOG_CORRUPTED])
-        self._corrupted_by_channel = len(df.loc[df["event"] == Log.LOG_CORRUPTED_BY_CHANNEL])
-        self._dropped = len(df.loc[df["event"] == Log.LOG_QUEUE_DROPPED])
-        self._generated = len(df.loc[df["event"] == Log.LOG_GENERATED])
-        self._incoming = len(self._received) + self._corrupted + self._corrupted_by_channel
+        self._received = count_events(df, Log.LOG_RECEIVED)
+        self._received_bytes = received_bytes(df)
+        self._corrupted = count_events(df, Log.LOG_CORRUPTED)
+        self._corrupted_by_channel = count_events(df, Log.LOG_CORRUPTED_BY_CHANNEL)
+        self._dropped = count_events(df, Log.LOG_QUEUE_DROPPED)
+        self._generated = count_events(df, Log.LOG_GENERATED)
+        self._incoming = self._received + self._corrupted + self._corrupted_by_channel
 
     def throughput(self):
         """
         Compute the throughput of a single node, at the receiver
         :return: the throughput, in Mbps
         """
-        return self._received["size"].sum() * 8 / self.simulation_time / 1024 / 1024
+        return self._received_bytes * 8 / self.simulation_time / 1024 / 1024
 
     def collision_rate(self):
         """
@@ -254,11 +424,8 @@ class SingleNodeAnalysis:
         if not self.folder_path.endswith("/"):
             self.folder_path += "/"
         self.file_name = file_name
-        info = self.file_name.split("_")
-        seed_format = info[2].split(".")
-        self.inter_arrival = int(info[1])
-        self.seed = int(seed_format[0])
-        df = pd.read_csv(self.folder_path + self.file_name)
+        self.inter_arrival, self.seed, self.antithetic = parse_file_name(self.file_name)
+        df = read_output(self.folder_path + self.file_name)
         self._n = len(df['dst'].unique())
         self._simulation_time = max(df['time'])
         self.nodes = []
@@ -266,6 +433,14 @@ class SingleNodeAnalysis:
         for i in range(1, self._n + 1):
             self.nodes.append(NodeData(df.loc[df['dst'] == i], self._simulation_time))
 
+    def replication(self):
+        """
+        Identifies the replication among the simulations with the same
+        inter-arrival time
+        :return: the tuple (seed, antithetic)
+        """
+        return self.seed, self.antithetic
+
     def offered_load(self):
         """
         Compute the offered load
@@ -1,7 +1,18 @@
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
 from unittest import TestCase
 
 from manager import AnalysisManager
 from simulation_analysis import SingleSimulation, SimulationGroupFolder
+import main
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "simulator"))
+import sim
+from config import Config
 
 
 class TestSingleSimulation(TestCase):
@@ -37,3 +48,44 @@ class TestPlotter(TestCase):
         print(len(res1.throughput))
         print(len(res1.collision_rate))
         print(len(res1.drop_rate))
+
+
+class TestVarianceReduction(TestCase):
+    def simulate(self, folder, use_realistic_propagation, **params):
+        # aloha runs of three seeds with common random numbers
+        section = {
+            "seed": [0, 1, 2], "duration": 0.5, "range": 10, "datarate": 8000000, "queue": 2,
+            "interarrival": {"distribution": "exp", "lambda": 200},
+            "size": {"distribution": "unif", "min": 32, "max": 1500, "int": 1},
+            "maxsize": 1500, "processing": {"distribution": "const", "mean": 0.000001},
+            "nodes": [[[0, 0], [5, 0], [0, 5], [5, 5], [12, 0]]],
+            "output": "output_{interarrival.lambda}_{seed}.csv", "common_random_numbers": True,
+        }
+        section.update(params)
+        os.makedirs(folder)
+        config_file = os.path.join(folder, "config.json")
+        with open(config_file, "w") as f:
+            json.dump({"simulation": section}, f)
+        for run in range(Config(config_file, "simulation").get_runs_count()):
+            simulator = sim.Sim()
+            simulator.set_config(config_file, "simulation", "aloha", use_realistic_propagation, None)
+            simulator.set_progress(sim.Sim.PROGRESS_NONE)
+            simulator.set_output_folder(folder)
+            simulator.initialize(run)
+            simulator.run()
+        os.remove(config_file)
+
+    def test_variance_reduction(self):
+        data_folder = tempfile.mkdtemp()
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.simulate(os.path.join(data_folder, "disk"), False)
+            # an antithetic pair for every seed
+            self.simulate(os.path.join(data_folder, "prob"), True, antithetic=[0, 1],
+                          output="output_{interarrival.lambda}_{seed}_{antithetic}.csv")
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            main.main(["-d", data_folder, "--variance-reduction", "disk", "prob"])
+        report = output.getvalue()
+        self.assertIn("Common random numbers: (Inter-arrival: 200, replications: 3", report)
+        self.assertIn("Antithetic pairs, prob: (Inter-arrival: 200, replications: 3", report)
+        self.assertNotIn("Antithetic pairs, disk", report)
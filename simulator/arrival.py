@@ -0,0 +1,87 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import
+
+from module import Module
+from distribution import Exp, BiasedExp
+from events import Events
+
+
+class ArrivalSource(Module):
+    """
+    Generates the packet arrivals of all nodes with a single event. When the
+    arrivals of each node form a Poisson process with the same rate, their
+    superposition is a Poisson process with the sum of the rates, and
+    assigning each of its arrivals to a node chosen uniformly at random gives
+    back independent Poisson processes with the original rate. The queue of
+    events thus holds a single arrival for the whole network instead of one
+    per node
+    """
+
+    def __init__(self, sim, nodes, rate):
+        """
+        Constructor.
+        :param sim: the simulation the source belongs to
+        :param nodes: the nodes receiving the arrivals
+        :param rate: the arrival rate of each node, in packets per second
+        """
+        Module.__init__(self, sim)
+        self.nodes = nodes
+        # interarrival time of the superposed process, and choice of the node
+        # receiving each arrival. same stream name as Node.STREAM_ARRIVAL
+        self.rng = sim.get_rng(self, "arrival")
+        if sim.arrival_bias != 1:
+            self.interarrival = BiasedExp(1.0 / (rate * len(nodes)), sim.arrival_bias, sim, self.rng)
+        else:
+            self.interarrival = Exp(1.0 / (rate * len(nodes)), rng=self.rng)
+        self.register_handler(Events.PACKET_ARRIVAL, self.handle_arrival)
+
+    def initialize(self):
+        """
+        Initialization. Schedules the first arrival
+        """
+        self.schedule_next_arrival()
+
+    def schedule_next_arrival(self):
+        """
+        Schedules the next arrival of the superposed process
+        """
+        event = self.sim.new_event(self.sim.get_time() + self.interarrival.get_value(),
+                                   Events.PACKET_ARRIVAL, self, self)
+        self.sim.schedule_event(event)
+
+    def handle_arrival(self, event):
+        """
+        Delivers an arrival to a node chosen at random, and schedules the next
+        one
+        :param event: the PACKET_ARRIVAL event
+        """
+        node = self.nodes[self.rng.randrange(len(self.nodes))]
+        node.packet_arrival()
+        self.schedule_next_arrival()
+
+    @staticmethod
+    def get_rate(distribution):
+        """
+        Returns the rate of the Poisson process generated by an interarrival
+        distribution
+        :param distribution: the interarrival distribution, an instance of
+        Distribution
+        :returns: the rate, or None if the interarrival times are not
+        exponential, and thus arrivals cannot be superposed
+        """
+        d = distribution.d
+        if isinstance(d, Exp) and not d.integer:
+            return d.l
+        return None
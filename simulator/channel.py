@@ -14,10 +14,15 @@
 # Copyright (C) 2016 Michele Segata <segata@ccs-labs.org>
 from __future__ import absolute_import
 import math
-import copy
+import itertools
+try:
+    import numpy
+except ImportError:
+    # candidate neighbors are always found with the grid
+    numpy = None
 from module import Module
-from event import Event
 from events import Events
+from packet import Reception
 
 
 class Channel(Module):
@@ -32,36 +37,75 @@ class Channel(Module):
     PAR_RANGE = "range"
     # speed of light in m/s, used to compute propagation delay
     SOL = 299792458.0
+    # if true, the beginning and the end of a transmission are notified to
+    # the neighbors with one event per group of neighbors rather than with
+    # one event per neighbor. optional, false if missing
+    PAR_BROADCAST = "broadcast_rx"
+    # in broadcast mode, neighbors whose propagation delays fall in the same
+    # multiple of this quantum (seconds) are notified together. if 0 or
+    # missing, only neighbors with exactly the same delay are grouped
+    PAR_BROADCAST_QUANTUM = "broadcast_quantum"
+    # maximum number of nodes for which neighbors are found by computing the
+    # distance between all pairs with numpy. the memory needed grows with
+    # the square of the number of nodes
+    NUMPY_MAX_NODES = 2000
 
-    def __init__(self, config, use_realistic_propagation):
+    def __init__(self, sim, config, use_realistic_propagation):
         """
         Constructor.
+        :param sim: the simulation the channel belongs to
         :param config: the set of configs loaded by the simu to obtain, for
         example, the communication range. The parameter is an instance of the
         Config class
         :param use_realistic_propagation: True to use the realistic propagation
         """
         # call superclass constructor
-        Module.__init__(self)
+        Module.__init__(self, sim)
         # get transmission range from configuration parameters
         self.range = config.get_param(self.PAR_RANGE)
         # list of all communication nodes in the simulation
         self.nodes = []
-        # map of neighbors that maps each node id to the list of its neighbors
-        self.neighbors = {}
+        # map from each node id to the links towards its neighbors, in order
+        # of registration, as (neighbor, propagation delay, probability of
+        # correct reception) tuples. positions never change, so these values
+        # are computed once, when nodes are registered. see build_topology()
+        self.links = {}
         # set propagation model
         self.use_realistic_propagation = use_realistic_propagation
+        # notification of receptions to groups of neighbors
+        self.broadcast = config.get_optional_param(self.PAR_BROADCAST, False)
+        self.broadcast_quantum = config.get_optional_param(self.PAR_BROADCAST_QUANTUM, 0)
+        self.register_handler(Events.START_RX, self.handle_start_rx)
+        self.register_handler(Events.END_RX, self.handle_end_rx)
 
     def register_node(self, node):
         """
         Registers a node participating to the simulation. This way the channel
         knows who is participating and can notify them when transmissions start
-        or end
+        or end. Only the links between the new node and the ones registered
+        before are computed, but register_nodes() is faster to register many
+        nodes at once
         :param node: the node to register, an instance of the Node class
         """
+        links = []
+        for other in self.nodes:
+            distance = self.distance(node, other)
+            if distance < self.range:
+                # the link is symmetric: add it to the other node as well
+                delay, probability = self.link_properties(distance)
+                links.append((other, delay, probability))
+                self.links[other.get_id()].append((node, delay, probability))
         self.nodes.append(node)
-        # recompute the neighbors of all nodes considering the new node as well
-        self.recompute_neighbors(node)
+        self.links[node.get_id()] = links
+
+    def register_nodes(self, nodes):
+        """
+        Registers a list of nodes participating to the simulation, and
+        rebuilds the topology
+        :param nodes: the nodes to register, instances of the Node class
+        """
+        self.nodes.extend(nodes)
+        self.build_topology()
 
     def distance(self, a, b):
         """
@@ -72,23 +116,122 @@ class Channel(Module):
         return math.sqrt(math.pow(a.get_posx() - b.get_posx(), 2) +
                          math.pow(a.get_posy() - b.get_posy(), 2))
 
-    def recompute_neighbors(self, new_node):
+    def link_properties(self, distance):
+        """
+        Computes the properties of a link
+        :param distance: length of the link
+        :returns: a tuple (propagation delay, probability of correct reception
+        with the realistic propagation)
+        """
+        # propagation delay: distance / speed of light
+        return distance / Channel.SOL, 1 - pow(distance / self.range, 1.0 / 3.0)
+
+    def build_topology(self):
+        """
+        Computes the links of all nodes, i.e., for each node the nodes within
+        communication range, in order of registration. With numpy, for up to
+        NUMPY_MAX_NODES nodes, the distances between all pairs of nodes are
+        computed at once. Otherwise, nodes are placed in a grid of cells as
+        large as the range, so that only the nodes in the 9 cells around a
+        node are checked. Both give exactly the same values as distance().
+        Links are computed in compressed sparse row format: the links from
+        node i are the ones from offsets[i] to offsets[i + 1] of the lists of
+        neighbor indices, delays and probabilities. They are then stored as
+        lists of tuples, which are faster to iterate for every transmission
+        """
+        if numpy is not None and len(self.nodes) <= self.NUMPY_MAX_NODES:
+            offsets, adjacency, delays, probabilities = self.pairwise_topology()
+        else:
+            offsets, adjacency, delays, probabilities = self.grid_topology()
+        neighbors = [self.nodes[j] for j in adjacency]
+        self.links = {}
+        for i, node in enumerate(self.nodes):
+            start = offsets[i]
+            end = offsets[i + 1]
+            self.links[node.get_id()] = list(zip(neighbors[start:end], delays[start:end],
+                                                 probabilities[start:end]))
+
+    def pairwise_topology(self):
+        """
+        Computes the links of all nodes with numpy, from the distances between
+        all pairs of nodes
+        :returns: a tuple (offsets, adjacency, delays, probabilities) of lists
+        """
+        n = len(self.nodes)
+        x = numpy.array([node.get_posx() for node in self.nodes], dtype=float)
+        y = numpy.array([node.get_posy() for node in self.nodes], dtype=float)
+        # the same operations of distance(), in the same order, so that the
+        # result is exactly the same
+        dx = x[:, None] - x[None, :]
+        dy = y[:, None] - y[None, :]
+        distances = numpy.sqrt(dx * dx + dy * dy)
+        within = distances < self.range
+        numpy.fill_diagonal(within, False)
+        # neighbor indices and distances, row by row
+        adjacency = numpy.nonzero(within)[1]
+        distances = distances[within]
+        offsets = numpy.zeros(n + 1, dtype=int)
+        numpy.cumsum(within.sum(axis=1), out=offsets[1:])
+        # propagation delay: distance / speed of light
+        delays = distances / Channel.SOL
+        # cube roots with pow() as the rest of the simulator, as numpy might
+        # round them differently
+        roots = numpy.fromiter(map(pow, (distances / self.range).tolist(), itertools.repeat(1.0 / 3.0)),
+                               dtype=float, count=len(distances))
+        return offsets.tolist(), adjacency.tolist(), delays.tolist(), (1 - roots).tolist()
+
+    def grid_topology(self):
+        """
+        Computes the links of all nodes with a uniform grid, whose cells are
+        as large as the range. The neighbors of a node can only be in its cell
+        or in the 8 cells around it
+        :returns: a tuple (offsets, adjacency, delays, probabilities) of lists
+        """
+        offsets = [0]
+        adjacency = []
+        delays = []
+        probabilities = []
+        if self.range <= 0:
+            return [0] * (len(self.nodes) + 1), adjacency, delays, probabilities
+        cells = {}
+        keys = []
+        for i, node in enumerate(self.nodes):
+            key = (int(math.floor(node.get_posx() / self.range)), int(math.floor(node.get_posy() / self.range)))
+            keys.append(key)
+            cells.setdefault(key, []).append(i)
+        for i, node in enumerate(self.nodes):
+            cx, cy = keys[i]
+            near = []
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    near.extend(cells.get((cx + dx, cy + dy), ()))
+            near.sort()
+            for j in near:
+                distance = self.distance(node, self.nodes[j])
+                if j != i and distance < self.range:
+                    delay, probability = self.link_properties(distance)
+                    adjacency.append(j)
+                    delays.append(delay)
+                    probabilities.append(probability)
+            offsets.append(len(adjacency))
+        return offsets, adjacency, delays, probabilities
+
+    def get_links(self, node):
         """
-        Updates the map of neighbors, i.e., for each node it computes the list
-        of nodes within communication range and stores such list
-        :param new_node: the node just added to the simulation
+        Returns the links from a node to its neighbors
+        :param node: the node
+        :returns: the list of (neighbor, propagation delay, probability of
+        correct reception) tuples, in order of registration of the neighbors
         """
-        # neighbors for the newest node
-        new_node_neighbors = []
-        for n in self.nodes:
-            # if the node n is within communication range of the newest node
-            if n.get_id() != new_node.get_id() and \
-               self.distance(n, new_node) < self.range:
-                # add n to the neighbors of the new node and vice versa
-                new_node_neighbors.append(n)
-                self.neighbors[n.get_id()].append(new_node)
-        # save neighbors for the new node in the map
-        self.neighbors[new_node.get_id()] = new_node_neighbors
+        return self.links[node.get_id()]
+
+    def get_neighbors(self, node):
+        """
+        Returns the neighbors of a node
+        :param node: the node
+        :returns: the list of nodes within range, in order of registration
+        """
+        return [link[0] for link in self.get_links(node)]
 
     def start_transmission(self, source_node, packet):
         """
@@ -97,19 +240,71 @@ class Channel(Module):
         :param source_node: node that starts the transmission
         :param packet: packet being transmitted
         """
-        for neighbor in self.neighbors[source_node.get_id()]:
-            # compute propagation delay: distance / speed of light
-            propagation_delay = self.distance(source_node, neighbor) /\
-                                Channel.SOL
-            if self.use_realistic_propagation:
-                distance = self.distance(source_node, neighbor)
-                packet.correct_reception_probability = 1 - pow(distance / self.range, 1.0 / 3.0)
+        if self.broadcast:
+            self.broadcast_transmission(source_node, packet)
+            return
+        now = self.sim.get_time()
+        new_event = self.sim.new_event
+        schedule_event = self.sim.schedule_event
+        realistic = self.use_realistic_propagation
+        for neighbor, propagation_delay, probability in self.links[source_node.get_id()]:
             # generate and schedule START_RX event at receiver
-            # be sure to make a copy of the packet and not pass the same
-            # reference to multiple nodes, as they will process the packet in
-            # different ways. one node might be able to receive it, one node
-            # might not
-            event = Event(self.sim.get_time() + propagation_delay,
-                          Events.START_RX, neighbor, source_node,
-                          copy.deepcopy(packet))
+            # be sure to give each receiver its own reception and not the
+            # packet itself, as they will process the packet in different
+            # ways. one node might be able to receive it, one node might not
+            reception = Reception(packet, probability if realistic else packet.correct_reception_probability)
+            event = new_event(now + propagation_delay, Events.START_RX, neighbor, source_node, reception)
+            schedule_event(event)
+
+    def broadcast_transmission(self, source_node, packet):
+        """
+        Begins transmission of a frame on the channel in broadcast mode.
+        Neighbors are grouped by propagation delay, and each group is notified
+        with a single START_RX event, whose content is the list of
+        (neighbor, reception) pairs. When the quantum is 0, a group
+        includes the neighbors receiving the frame at exactly the same time,
+        so that each neighbor processes the frame exactly as with one event
+        per neighbor. Otherwise, a group includes the neighbors whose delay
+        falls in the same quantum, which are notified at the smallest delay
+        of the group, in order of delay
+        :param source_node: node that starts the transmission
+        :param packet: packet being transmitted
+        """
+        now = self.sim.get_time()
+        groups = {}
+        for neighbor, propagation_delay, probability in self.links[source_node.get_id()]:
+            if not self.use_realistic_propagation:
+                probability = packet.correct_reception_probability
+            if self.broadcast_quantum > 0:
+                key = int(propagation_delay / self.broadcast_quantum)
+            else:
+                key = now + propagation_delay
+            groups.setdefault(key, []).append((propagation_delay, neighbor, Reception(packet, probability)))
+        for group in groups.values():
+            # sorting is stable: with exact grouping, all delays are the same
+            # and neighbors keep their order
+            group.sort(key=lambda r: r[0])
+            receptions = [(neighbor, reception) for _, neighbor, reception in group]
+            event = self.sim.new_event(now + group[0][0], Events.START_RX, self, source_node, receptions)
             self.sim.schedule_event(event)
+
+    def handle_start_rx(self, event):
+        """
+        Notifies a group of neighbors about the beginning of a frame, and
+        schedules the end of the reception for the whole group
+        :param event: the START_RX event, including the list of receptions
+        """
+        receptions = event.get_obj()
+        for neighbor, packet in receptions:
+            neighbor.start_rx(packet)
+        end_rx = self.sim.new_event(self.sim.get_time() + receptions[0][1].get_duration(),
+                                    Events.END_RX, self, event.get_source(), receptions)
+        self.sim.schedule_event(end_rx)
+
+    def handle_end_rx(self, event):
+        """
+        Notifies a group of neighbors about the end of a frame
+        :param event: the END_RX event, including the list of receptions
+        """
+        for neighbor, packet in event.get_obj():
+            neighbor.end_rx(packet)
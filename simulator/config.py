@@ -65,10 +65,7 @@ class Config:
         Get the flag to skip the sensing procedure when coming from IDLE state, for sensing protocols
         :return: True if the sensing phase is skipped, False otherwise
         """
-        if self.SKIP_SENSING in self.cfg[self.section]:
-            return self.cfg[self.section][self.SKIP_SENSING]
-        else:
-            return False
+        return self.get_optional_param(self.SKIP_SENSING, False)
 
     def map_parameters(self):
         """
@@ -172,6 +169,18 @@ class Config:
                   (param, self.section))
             sys.exit(1)
 
+    def get_optional_param(self, param, default):
+        """
+        Returns the value of a parameter from the configuration file, or a
+        default value if the parameter is not specified
+        :param param: the parameter's name
+        :param default: the value to return if the parameter is not found
+        """
+        if param in self.cfg[self.section]:
+            return self.get_param(param)
+        else:
+            return default
+
     def compute_output_file_name(self):
         """
         Computes output file name. The user can specify an output file name with
@@ -287,3 +296,23 @@ class Config:
         for par, val in self.par_map.items():
             params += "%s: %s " % (par, str(config[par][val[run_number]]))
         return params
+
+
+def parse_runs(runs):
+    """
+    Parses a list of run numbers given as a comma separated list of numbers
+    and ranges, e.g., "0-3,7,9-10" is parsed as [0, 1, 2, 3, 7, 9, 10]
+    :param runs: the textual list of runs
+    :returns: the list of run numbers, in the given order
+    """
+    numbers = []
+    for part in runs.split(","):
+        try:
+            if "-" in part:
+                first, last = part.split("-")
+                numbers.extend(range(int(first), int(last) + 1))
+            else:
+                numbers.append(int(part))
+        except ValueError:
+            raise ValueError("Invalid run range %s" % part)
+    return numbers
@@ -17,6 +17,8 @@ import random
 import sys
 import math
 
+from tracefile import TraceStream, TraceInterarrival, TraceSize
+
 
 class Distribution:
     """
@@ -42,8 +44,12 @@ class Distribution:
     UNIFORM = "unif"
     # exponential random variable
     EXPONENTIAL = "exp"
+    # interarrival times read from a trace file
+    TRACE = "trace"
+    # trace file field
+    FILE = "file"
 
-    def __init__(self, config):
+    def __init__(self, config, rng=None, index=0):
         """
         Instantiates the distribution
         :param config: an object used for configuring the distribution in the
@@ -54,6 +60,13 @@ class Distribution:
         with mean being 1/lambda. "lambda" : value can also be used
         {"distribution" : "unif", "min" : value, "max" : value}, uniform random
         variable between min and max
+        {"distribution" : "trace", "file" : name}, interarrival times read from
+        a trace file (see tracefile.Trace). The packet sizes of the trace are
+        returned by get_trace_sizes()
+        :param rng: the random number generator to draw values from, an
+        instance of random.Random. If None, the global generator of the random
+        module is used
+        :param index: for traces, index of the node in the trace
         """
         try:
             # find the correct distribution depending on the specified name
@@ -68,7 +81,7 @@ class Distribution:
                 except Exception:
                     integer = False
                 self.d = Uniform(config[Distribution.MIN],
-                                 config[Distribution.MAX], integer)
+                                 config[Distribution.MAX], integer, rng)
             elif config[Distribution.DISTRIBUTION] == Distribution.EXPONENTIAL:
                 integer = False
                 try:
@@ -78,9 +91,11 @@ class Distribution:
                 except Exception:
                     integer = False
                 if Distribution.MEAN in config:
-                    self.d = Exp(config[Distribution.MEAN], integer)
+                    self.d = Exp(config[Distribution.MEAN], integer, rng)
                 else:
-                    self.d = Exp(1.0/config[Distribution.LAMBDA], integer)
+                    self.d = Exp(1.0/config[Distribution.LAMBDA], integer, rng)
+            elif config[Distribution.DISTRIBUTION] == Distribution.TRACE:
+                self.d = TraceInterarrival(TraceStream(config[Distribution.FILE], index))
             else:
                 print("Distribution error: unimplemented distribution %s",
                       config[Distribution.DISTRIBUTION])
@@ -92,6 +107,50 @@ class Distribution:
     def get_value(self):
         return self.d.get_value()
 
+    def get_values(self, n):
+        """
+        Draws several values at once. The values are the same that n calls to
+        get_value() would return
+        :param n: number of values
+        :returns: the list of values
+        """
+        return self.d.get_values(n)
+
+    def is_constant(self):
+        """
+        Returns True if the distribution always returns the same value
+        """
+        return isinstance(self.d, Const)
+
+    def is_trace(self):
+        """
+        Returns True if the values are read from a trace
+        """
+        return isinstance(self.d, TraceInterarrival)
+
+    def get_trace_sizes(self):
+        """
+        Returns the packet sizes of a trace, as an object with the get_value()
+        and get_values() methods. Sizes must be read in the same order as the
+        interarrival times
+        """
+        return TraceSize(self.d.stream)
+
+    def set_bias(self, bias, accumulator):
+        """
+        Draws values from a biased version of the distribution, for
+        importance sampling. Only continuous exponential distributions can
+        be biased
+        :param bias: factor multiplying the rate
+        :param accumulator: object whose log_weight attribute accumulates the
+        log likelihood ratio of the drawn values
+        :returns: False if the distribution cannot be biased
+        """
+        if not isinstance(self.d, Exp) or self.d.integer:
+            return False
+        self.d = BiasedExp(1.0 / self.d.l, bias, accumulator, self.d.rng)
+        return True
+
 
 class Const:
     """
@@ -108,47 +167,219 @@ class Const:
     def get_value(self):
         return self.value
 
+    def get_values(self, n):
+        return [self.value] * n
+
 
 class Uniform:
     """
     Uniform random variable
     """
 
-    def __init__(self, min, max, integer=False):
+    def __init__(self, min, max, integer=False, rng=None):
         """
         Constructor
         :param min: minimum value
         :param max: maximum value
         :param integer: whether to use integer or floating point numbers
+        :param rng: random number generator. If None, the random module is used
         """
         self.min = min
         self.max = max
         self.integer = integer
+        self.rng = random if rng is None else rng
 
     def get_value(self):
-        value = random.uniform(self.min, self.max)
+        value = self.rng.uniform(self.min, self.max)
         if self.integer:
             return round(value)
         else:
             return value
 
+    def get_values(self, n):
+        # bind the method and the bounds once for the whole block
+        uniform = self.rng.uniform
+        a = self.min
+        b = self.max
+        if self.integer:
+            return [round(uniform(a, b)) for _ in range(n)]
+        else:
+            return [uniform(a, b) for _ in range(n)]
+
 
 class Exp:
     """
     Exponential random variable
     """
 
-    def __init__(self, mean, integer=False):
+    def __init__(self, mean, integer=False, rng=None):
         """
         Constructor
         :param mean: mean value (1/lambda)
         :param integer: if set to true, random values are discretized with ceil
+        :param rng: random number generator. If None, the random module is used
         """
         self.l = 1.0/mean
         self.integer = integer
+        self.rng = random if rng is None else rng
 
     def get_value(self):
         if self.integer:
-            return math.ceil(random.expovariate(self.l))
+            return math.ceil(self.rng.expovariate(self.l))
+        else:
+            return self.rng.expovariate(self.l)
+
+    def get_values(self, n):
+        expovariate = self.rng.expovariate
+        l = self.l
+        if self.integer:
+            return [math.ceil(expovariate(l)) for _ in range(n)]
         else:
-            return random.expovariate(self.l)
+            return [expovariate(l) for _ in range(n)]
+
+
+class BiasedExp(Exp):
+    """
+    Exponential random variable drawn with a biased rate, for importance
+    sampling. The rate l of the nominal distribution is kept in the l
+    attribute, while values are drawn with rate bias * l. For every value x,
+    the log of the likelihood ratio between the nominal and the biased
+    density, log(1 / bias) + (bias - 1) * l * x, is added to the log_weight
+    attribute of an accumulator
+    """
+
+    def __init__(self, mean, bias, accumulator, rng=None):
+        """
+        Constructor
+        :param mean: mean value of the nominal distribution (1/lambda)
+        :param bias: factor multiplying the rate
+        :param accumulator: object whose log_weight attribute accumulates the
+        log likelihood ratio of the drawn values
+        :param rng: random number generator. If None, the random module is used
+        """
+        Exp.__init__(self, mean, False, rng)
+        self.biased_l = self.l * bias
+        self.accumulator = accumulator
+        # terms of the log likelihood ratio
+        self.log_ratio = -math.log(bias)
+        self.rate_difference = self.biased_l - self.l
+
+    def get_value(self):
+        value = self.rng.expovariate(self.biased_l)
+        self.accumulator.log_weight += self.log_ratio + self.rate_difference * value
+        return value
+
+    def get_values(self, n):
+        expovariate = self.rng.expovariate
+        l = self.biased_l
+        values = [expovariate(l) for _ in range(n)]
+        self.accumulator.log_weight += n * self.log_ratio + self.rate_difference * math.fsum(values)
+        return values
+
+
+class Buffered:
+    """
+    Stream of values of a distribution, drawn in blocks. When the buffer runs
+    out, the next block_size values are drawn at once with get_values(), and
+    then returned one by one. The stream returns the same values as calling
+    get_value() on the distribution, but the random numbers of a block are
+    all taken from the generator when the block is filled. With a generator
+    shared by several streams, the values of each stream thus depend on the
+    seed and on the order in which buffers run out, but not on the order of
+    the single draws
+    """
+
+    # default number of values drawn at once
+    BLOCK_SIZE = 1024
+
+    def __init__(self, distribution, block_size=None):
+        """
+        Constructor
+        :param distribution: the distribution to draw values from, any object
+        implementing get_values()
+        :param block_size: number of values drawn at once. If None,
+        BLOCK_SIZE is used
+        """
+        self.distribution = distribution
+        self.block_size = Buffered.BLOCK_SIZE if block_size is None else block_size
+        # values still to be returned, in reverse order so that the next one
+        # can be popped from the end
+        self.values = []
+
+    def get_value(self):
+        values = self.values
+        if not values:
+            values.extend(self.distribution.get_values(self.block_size))
+            values.reverse()
+        return values.pop()
+
+    def get_values(self, n):
+        return [self.get_value() for _ in range(n)]
+
+    def is_constant(self):
+        d = self.distribution
+        return d.is_constant() if isinstance(d, Distribution) else isinstance(d, Const)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.get_value()
+
+
+class Antithetic(random.Random):
+    """
+    Random number generator returning the antithetic values of the standard
+    one: when seeded in the same way, it returns 1 - u wherever random.Random
+    returns u. Continuous distributions computed by inversion from random(),
+    like uniform() and expovariate(), thus give values negatively correlated
+    with the ones of the standard generator
+    """
+
+    def random(self):
+        u = random.Random.random(self)
+        # keep 0 as it is, as 1 is out of the range of random()
+        return 1.0 - u if u > 0.0 else u
+
+
+def poisson(mean, rng=None):
+    """
+    Draws a Poisson random variable. Small means use Knuth's multiplication
+    method, whose cost grows with the mean, while larger means use the
+    transformed rejection method PTRS (W. Hormann, "The transformed rejection
+    method for generating Poisson random variables", 1993), whose cost is
+    constant
+    :param mean: mean of the variable
+    :param rng: random number generator. If None, the random module is used
+    :returns: the drawn value
+    """
+    rng = random if rng is None else rng
+    if mean < 10:
+        # multiply uniform variables until the product falls below e^-mean
+        limit = math.exp(-mean)
+        k = 0
+        p = rng.random()
+        while p > limit:
+            k += 1
+            p *= rng.random()
+        return k
+    sqrt_mean = math.sqrt(mean)
+    log_mean = math.log(mean)
+    b = 0.931 + 2.53 * sqrt_mean
+    a = -0.059 + 0.02483 * b
+    inv_alpha = 1.1239 + 1.1328 / (b - 3.4)
+    v_r = 0.9277 - 3.6224 / (b - 2)
+    while True:
+        u = rng.random() - 0.5
+        v = rng.random()
+        us = 0.5 - abs(u)
+        k = int(math.floor((2 * a / us + b) * u + mean + 0.43))
+        # quick acceptance
+        if us >= 0.07 and v <= v_r:
+            return k
+        # quick rejection
+        if k < 0 or (us < 0.013 and v > us):
+            continue
+        if math.log(v) + math.log(inv_alpha) - math.log(a / (us * us) + b) <= \
+           -mean + k * log_mean - math.lgamma(k + 1):
+            return k
@@ -20,7 +20,13 @@ class Event:
     """
     Defines the basic structure of an event
     """
-    # counter used for assigning unique IDs to events
+    # events are created and destroyed at a very high rate: slots avoid the
+    # per-instance dictionary
+    __slots__ = ("event_id", "event_time", "event_type", "destination",
+                 "source", "obj", "pending")
+
+    # counter used for assigning unique IDs to events. when an event is
+    # scheduled, the simulation replaces its ID with one from its own counter
     event_counter = 0
 
     def __init__(self, event_time, event_type, destination, source, obj=None):
@@ -39,6 +45,10 @@ class Event:
         self.destination = destination
         self.source = source
         self.obj = obj
+        # True while the event sits in the simulation queue and has not been
+        # canceled. canceled events are left in the queue and skipped when
+        # they reach the top of it
+        self.pending = False
 
     def __eq__(self, other):
         if not isinstance(other, Event):
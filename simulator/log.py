@@ -13,7 +13,8 @@
 #
 # Copyright (C) 2016 Michele Segata <segata@ccs-labs.org>
 from __future__ import absolute_import
-import sim
+import os
+import shutil
 from packet import Packet
 
 
@@ -36,11 +37,14 @@ class Log:
     LOG_QUEUE_SIZE = LOG_QUEUE_DROPPED + 1
     # use to log node state in time
     LOG_NODE_STATE = LOG_QUEUE_SIZE + 1
+    # first line of the output file
+    HEADER = "time,src,dst,event,size\n"
 
-    def __init__(self, output_file, log_packets=True, log_queue_drops=True,
+    def __init__(self, sim, output_file, log_packets=True, log_queue_drops=True,
                  log_arrivals=True, log_queue_lengths=False, log_states=False):
         """
         Constructor.
+        :param sim: the simulation being logged, used to get the current time
         :param output_file: output file name. will be overwritten if already
         existing
         :param log_packets: enable/disable logging of packets
@@ -50,15 +54,55 @@ class Log:
         :param log_queue_lengths: enable/disable logging of queue lengths
         :param log_states: enable/disable logging of the state of nodes
         """
-        self.sim = sim.Sim.Instance()
+        self.sim = sim
+        self.output_file = output_file
         self.log_file = open(output_file, "w")
-        self.log_file.write("time,src,dst,event,size\n")
+        self.log_file.write(self.HEADER)
         self.log_packets = log_packets
         self.log_queue_drops = log_queue_drops
         self.log_arrivals = log_arrivals
         self.log_queue_lengths = log_queue_lengths
         self.log_states = log_states
 
+    def __getstate__(self):
+        """
+        Returns the state of the logger when saving a checkpoint. The open file
+        is replaced by the amount of data written so far
+        """
+        self.log_file.flush()
+        state = self.__dict__.copy()
+        del state["log_file"]
+        state["offset"] = self.log_file.tell()
+        return state
+
+    def __setstate__(self, state):
+        """
+        Restores the logger from a checkpoint, reopening the output file and
+        discarding everything written after the checkpoint
+        """
+        offset = state.pop("offset")
+        self.__dict__.update(state)
+        self.log_file = open(self.output_file, "r+")
+        self.log_file.seek(offset)
+        self.log_file.truncate()
+
+    def redirect(self, output_file, keep=True):
+        """
+        Continues logging into a new output file, which starts with everything
+        logged so far
+        :param output_file: the new output file name
+        :param keep: if False, the current output file is moved to the new
+        one instead of being copied
+        """
+        self.log_file.close()
+        if output_file != self.output_file:
+            if keep:
+                shutil.copyfile(self.output_file, output_file)
+            else:
+                os.replace(self.output_file, output_file)
+        self.output_file = output_file
+        self.log_file = open(output_file, "a")
+
     def log_packet(self, source, destination, packet):
         """
         Logs the result of a packet reception.
@@ -72,27 +116,29 @@ class Log:
                                  destination.get_id(), packet.get_state(),
                                  packet.get_size()))
 
-    def log_queue_drop(self, source, packet_size):
+    def log_queue_drop(self, source, packet_size, time=None):
         """
         Logs a queue drop
         :param source: source node
         :param packet_size: size of the packet being dropped
+        :param time: time of the drop, if different from the current time
         """
         if self.log_queue_drops:
             self.log_file.write("%f,%d,%d,%d,%d\n" %
-                                (self.sim.get_time(), source.get_id(),
+                                (self.sim.get_time() if time is None else time, source.get_id(),
                                  source.get_id(), Log.LOG_QUEUE_DROPPED,
                                  packet_size))
 
-    def log_arrival(self, source, packet_size):
+    def log_arrival(self, source, packet_size, time=None):
         """
         Logs an arrival
         :param source: source node
         :param packet_size: size of the packet being dropped
+        :param time: time of the arrival, if different from the current time
         """
         if self.log_arrivals:
             self.log_file.write("%f,%d,%d,%d,%d\n" %
-                                (self.sim.get_time(), source.get_id(),
+                                (self.sim.get_time() if time is None else time, source.get_id(),
                                  source.get_id(), Log.LOG_GENERATED,
                                  packet_size))
 
@@ -117,3 +163,54 @@ class Log:
             self.log_file.write("%f,%d,%d,%d,%d\n" %
                                 (self.sim.get_time(), node.get_id(),
                                  node.get_id(), Log.LOG_NODE_STATE, state))
+
+    def close(self):
+        """
+        Closes the output file, flushing all logged data
+        """
+        self.log_file.close()
+
+
+class WeightedLog(Log):
+    """
+    Logger for importance sampling. Every line has an additional log_weight
+    column, with the log likelihood ratio accumulated by the simulation up
+    to the logged event. Weighting each event by the exponential of this
+    value gives unbiased estimates of the number of events under the nominal
+    distributions. The simulation must have a log_weight attribute
+    """
+
+    HEADER = "time,src,dst,event,size,log_weight\n"
+
+    def log_packet(self, source, destination, packet):
+        if self.log_packets:
+            self.log_file.write("%f,%d,%d,%d,%d,%r\n" %
+                                (self.sim.get_time(), source.get_id(),
+                                 destination.get_id(), packet.get_state(),
+                                 packet.get_size(), self.sim.log_weight))
+
+    def log_queue_drop(self, source, packet_size, time=None):
+        if self.log_queue_drops:
+            self.log_file.write("%f,%d,%d,%d,%d,%r\n" %
+                                (self.sim.get_time() if time is None else time, source.get_id(),
+                                 source.get_id(), Log.LOG_QUEUE_DROPPED,
+                                 packet_size, self.sim.log_weight))
+
+    def log_arrival(self, source, packet_size, time=None):
+        if self.log_arrivals:
+            self.log_file.write("%f,%d,%d,%d,%d,%r\n" %
+                                (self.sim.get_time() if time is None else time, source.get_id(),
+                                 source.get_id(), Log.LOG_GENERATED,
+                                 packet_size, self.sim.log_weight))
+
+    def log_queue_length(self, node, length):
+        if self.log_queue_lengths:
+            self.log_file.write("%f,%d,%d,%d,%d,%r\n" %
+                                (self.sim.get_time(), node.get_id(),
+                                 node.get_id(), Log.LOG_QUEUE_SIZE, length, self.sim.log_weight))
+
+    def log_state(self, node, state):
+        if self.log_states:
+            self.log_file.write("%f,%d,%d,%d,%d,%r\n" %
+                                (self.sim.get_time(), node.get_id(),
+                                 node.get_id(), Log.LOG_NODE_STATE, state, self.sim.log_weight))
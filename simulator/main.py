@@ -16,8 +16,10 @@
 
 from __future__ import absolute_import
 from optparse import OptionParser
+import signal
 import sys
 import sim
+from config import parse_runs
 
 # setup command line parameters
 parser = OptionParser(usage="usage: %prog [options]",
@@ -29,9 +31,10 @@ parser.add_option("-l", "--list", dest="list", default=False,
 parser.add_option("-L", "--LIST", dest="verbose_list", default=False,
                   action="store_true", help="list the available runs with "
                                             "simulation parameters and exit")
-parser.add_option("-r", "--run", dest="run", default=0, action="store",
-                  help="run simulation number RUN [default: %default]",
-                  metavar="RUN", type="int")
+parser.add_option("-r", "--run", dest="run", default="0", action="store",
+                  help="run simulation number RUN. Several runs can be executed one after the other, using a comma "
+                       "separated list of numbers and ranges, e.g., 0-61 or 0,3,5-7 [default: %default]",
+                  metavar="RUN")
 parser.add_option("-c", "--config", dest="config", default="config.json",
                   action="store",
                   help="simulation config file [default: %default]")
@@ -46,6 +49,54 @@ parser.add_option("-R", "--realistic_propagation", dest="propagation", default=F
                   help="Use realistic propagation")
 parser.add_option("-P", "--persistence", type=float, dest="persistence", default=None, action="store",
                   help="Set persistence of the Simple Carrier Sensing")
+parser.add_option("-S", "--scheduler", dest="scheduler", default=None, action="store",
+                  help="Scheduler used for the queue of events. It can be a binary heap (use 'heap'), a calendar " +
+                       "queue (use 'calendar'), a binary heap with FIFO lanes for constant delay events (use " +
+                       "'lanes'), or a radix heap (use 'radix'). Overrides the scheduler set in the config file.")
+parser.add_option("-t", "--time-resolution", dest="time_resolution", default=None, action="store", type=float,
+                  metavar="TICKS", help="Use an integer time base with TICKS ticks per second (e.g., 1e9 for " +
+                                        "nanoseconds): event times are rounded to the closest tick. Overrides the " +
+                                        "time resolution set in the config file.")
+parser.add_option("-o", "--output-folder", dest="output_folder", default="", action="store",
+                  help="folder where output files are written [default: current folder]")
+parser.add_option("--progress", dest="progress", default="bar", action="store", type="choice",
+                  choices=["bar", "lines", "none"],
+                  help="How to report the progress of the simulation: a progress bar (use 'bar'), one line with " +
+                       "simulation time, events per second and ETA per update (use 'lines'), or nothing (use 'none') " +
+                       "[default: %default]")
+parser.add_option("-q", "--quiet", dest="progress", action="store_const", const="none",
+                  help="Do not report the progress of the simulation. Same as --progress none")
+parser.add_option("--max-events", dest="max_events", default=None, action="store", type=int,
+                  help="Stop each run after processing this number of events, even if the simulation time has not " +
+                       "reached the duration. Overrides max_events in the config file.")
+parser.add_option("--max-wall-time", dest="max_wall_time", default=None, action="store", type=float,
+                  metavar="SECONDS", help="Stop each run after this number of seconds of real time, even if the " +
+                                          "simulation time has not reached the duration. Overrides max_wall_time " +
+                                          "in the config file.")
+parser.add_option("--gc", dest="gc_mode", default="default", action="store", type="choice",
+                  choices=["default", "freeze", "disable"],
+                  help="What to do with the cyclic garbage collector while simulating: nothing (use 'default'), " +
+                       "freeze all objects existing at the start so that collections ignore them (use 'freeze'), " +
+                       "or disable it (use 'disable') [default: %default]")
+parser.add_option("--profile", dest="profile", default=False, action="store_true",
+                  help="Print statistics about the execution of the simulation at the end of each run: events per " +
+                       "type, wall time of event handlers, channel and logging, and size of the queue of events")
+parser.add_option("--checkpoint", dest="checkpoint", default=None, action="store", metavar="FILE",
+                  help="Save the state of the simulation to FILE, periodically if --checkpoint-interval is set, and " +
+                       "whenever the process receives SIGUSR1. {run} in the name is replaced by the run number.")
+parser.add_option("--checkpoint-interval", dest="checkpoint_interval", default=None, action="store", type=float,
+                  metavar="SECONDS", help="Simulated time between two checkpoints")
+parser.add_option("--variants", dest="variants", default=None, action="store", metavar="VARIANTS",
+                  help="With Simple Carrier Sensing, run several variants of each run differing only in the " +
+                       "persistence, simulating the part they have in common only once. VARIANTS is a comma separated " +
+                       "list of FOLDER:PERSISTENCE pairs, and the output of each variant is written in its FOLDER. " +
+                       "With --checkpoint, each variant saves its state in its FOLDER, with the name of FILE.")
+parser.add_option("--no-fork", dest="fork", default=True, action="store_false",
+                  help="With --variants, run the variants one after the other from an in-memory snapshot instead of " +
+                       "forking a process per variant")
+parser.add_option("--restore", dest="restore", default=None, action="store", metavar="FILE",
+                  help="Continue the simulation saved in the checkpoint FILE. The run and simulation parameters are " +
+                       "the ones of the saved simulation.")
 
 # parse options
 (options, args) = parser.parse_args()
@@ -55,8 +106,56 @@ if options.config == "" or options.section == "":
     print(parser.get_usage())
     sys.exit(1)
 
-simulator = sim.Sim.Instance()
-simulator.set_config(options.config, options.section, options.protocol, options.propagation, options.persistence)
+if options.checkpoint_interval is not None and options.checkpoint is None:
+    print("--checkpoint-interval requires --checkpoint")
+    sys.exit(1)
+
+
+def request_checkpoint(signum, frame):
+    """
+    Signal handler saving the state of the running simulation
+    """
+    simulator.request_checkpoint()
+
+
+if options.checkpoint is not None and hasattr(signal, "SIGUSR1"):
+    signal.signal(signal.SIGUSR1, request_checkpoint)
+
+if options.restore is not None:
+    # continue a saved simulation
+    simulator = sim.Sim.restore(options.restore)
+    simulator.set_progress(options.progress)
+    simulator.set_gc_mode(options.gc_mode)
+    simulator.set_limits(options.max_events, options.max_wall_time)
+    if options.checkpoint is not None:
+        simulator.set_checkpoint(options.checkpoint.format(run=simulator.run_number), options.checkpoint_interval)
+    simulator.run()
+    sys.exit(0)
+
+try:
+    runs = parse_runs(options.run)
+except ValueError as e:
+    print(e)
+    print(parser.get_usage())
+    sys.exit(1)
+
+variants = None
+if options.variants is not None:
+    if options.protocol != sim.Sim.SIMPLE_CARRIER_SENSING:
+        print("--variants can only be used with Simple Carrier Sensing")
+        sys.exit(1)
+    try:
+        variants = [(v.split(":")[0], float(v.split(":")[1])) for v in options.variants.split(",")]
+    except (IndexError, ValueError):
+        print("Invalid variants %s" % options.variants)
+        sys.exit(1)
+    # the persistence of the first variant is used to initialize the simulation
+    if options.persistence is None:
+        options.persistence = variants[0][1]
+
+simulator = sim.Sim()
+simulator.set_config(options.config, options.section, options.protocol, options.propagation, options.persistence,
+                     options.scheduler)
 
 # list simulation runs and exit
 if options.list or options.verbose_list:
@@ -70,5 +169,23 @@ if options.list or options.verbose_list:
                   (options.config, options.section, i, simulator.get_params(i)))
     sys.exit(0)
 
-simulator.initialize(options.run)
-simulator.run()
+# each run uses a new simulation instance
+for run in runs:
+    simulator = sim.Sim()
+    simulator.set_config(options.config, options.section, options.protocol, options.propagation, options.persistence,
+                         options.scheduler)
+    simulator.set_progress(options.progress)
+    simulator.set_output_folder(options.output_folder)
+    simulator.set_gc_mode(options.gc_mode)
+    simulator.set_profiling(options.profile)
+    simulator.set_limits(options.max_events, options.max_wall_time)
+    if options.time_resolution is not None:
+        simulator.set_time_resolution(options.time_resolution)
+    simulator.initialize(run)
+    if options.checkpoint is not None:
+        simulator.set_checkpoint(options.checkpoint.format(run=run), options.checkpoint_interval)
+    if variants is not None:
+        if len(simulator.run_variants(variants, options.fork)) > 0:
+            sys.exit(1)
+    else:
+        simulator.run()
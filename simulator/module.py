@@ -1,7 +1,6 @@
 from __future__ import absolute_import
 
 import sys
-import sim
 
 
 class Module:
@@ -10,21 +9,20 @@ class Module:
     that all modules should inherit from
     """
 
-    # static class variable automatically incremented everytime a new module is
-    # instantiated
-    __modules_count = 0
-
-    def __init__(self):
+    def __init__(self, sim):
         """
-        Constructor. Gets simulation instance for scheduling events and
+        Constructor. Saves the simulation instance for scheduling events and
         automatically assigns an ID to the module
+        :param sim: the simulation the module belongs to
         """
-        self.sim = sim.Sim.Instance()
-        # auto assign module id
-        self.module_id = Module.__modules_count
-        Module.__modules_count = Module.__modules_count + 1
+        self.sim = sim
+        # auto assign module id. ids are unique within a simulation
+        self.module_id = sim.next_module_id()
         # get data logger from simu
         self.logger = self.sim.get_logger()
+        # map from event type to the method handling it. the simulation
+        # calls handlers directly, without going through handle_event()
+        self.handlers = {}
 
     def initialize(self):
         """
@@ -33,15 +31,36 @@ class Module:
         """
         return
 
+    def finalize(self):
+        """
+        Finalization method called by the simulation when it stops running,
+        before closing the output file. Modules that defer some work can
+        complete it here
+        """
+        return
+
+    def register_handler(self, event_type, handler):
+        """
+        Registers the method handling a type of event. Inheriting modules
+        should register a handler for each type of event they receive
+        :param event_type: the type of event
+        :param handler: a function taking the event as parameter
+        """
+        self.handlers[event_type] = handler
+
     def handle_event(self, event):
         """
-        This function should be overridden by inheriting modules to handle
-        events for this module. If not overridden, this method will throw an
-        error and stop the simulation
+        Handles an event by calling the handler registered for its type. If no
+        handler is registered, this method will throw an error and stop the
+        simulation
         """
-        print("Module error: class %s does not override handle_event() method",
-              self.get_type())
-        sys.exit(1)
+        handler = self.handlers.get(event.get_type())
+        if handler is None:
+            print("Module error: %s %d has received a notification for event "
+                  "type %d which can't be handled" %
+                  (self.get_type(), self.get_id(), event.get_type()))
+            sys.exit(1)
+        handler(event)
 
     def get_id(self):
         """
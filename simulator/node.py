@@ -14,14 +14,21 @@
 # Copyright (C) 2016 Michele Segata <segata@ccs-labs.org>
 from __future__ import absolute_import
 
-import sys
 from module import Module
-from distribution import Distribution, Uniform, Exp
-from event import Event
+from distribution import Distribution, Uniform, Exp, BiasedExp, Buffered, poisson
+from arrival import ArrivalSource
 from events import Events
 from packet import Packet
 
 
+class VariantDivergence(Exception):
+    """
+    Raised while simulating the prefix shared by several variants of a
+    simulation, when a node uses a parameter that differs among them
+    """
+    pass
+
+
 class Node(Module):
     """
     This class implements a node capable of communicating with other devices
@@ -39,12 +46,28 @@ class Node(Module):
     PROC_TIME = "processing"
     # max packet size (bytes)
     MAXSIZE = "maxsize"
+    # skip the arrivals while the queue is full, accounting for them when it
+    # frees up. optional, false if missing
+    SKIP_BLOCKED_ARRIVALS = "skip_blocked_arrivals"
+    # draw random values in blocks, either true or the block size. optional,
+    # false if missing
+    BUFFERED_VARIATES = "buffered_variates"
+    # names of the random number streams of a node, used when the simulation
+    # gives each node independent streams
+    STREAM_ARRIVAL = "arrival"
+    STREAM_SIZE = "size"
+    STREAM_PROCESSING = "processing"
+    STREAM_RECEPTION = "reception"
+    STREAM_PERSISTENCE = "persistence"
+    STREAM_BACKOFF = "backoff"
     # available protocols
     ALOHA = "aloha"
     TRIVIAL_CARRIER_SENSING = "trivial"
     SIMPLE_CARRIER_SENSING = "simple"
     # sense time
     SENSE_TIME = 50e-6
+    # interarrival time returned when there are no more arrivals
+    NO_ARRIVAL = float("inf")
 
     # list of possible states for this node
     IDLE = 0
@@ -54,24 +77,49 @@ class Node(Module):
     SENSING = 4
     WT = 5
 
-    def __init__(self, config, channel, x, y, protocol, persistence):
+    def __init__(self, sim, config, channel, x, y, protocol, persistence, own_arrivals=True, index=0):
         """
         Constructor.
+        :param sim: the simulation the node belongs to
         :param config: the set of configs loaded by the simu
         :param channel: the channel to which frames are sent
         :param x: x position
         :param y: y position
         :param protocol: the protocol to use. Either aloha or trivial carrier sensing
         :param persistence: persistence probability, to use only in case of Simple Carrier Sensing
+        :param own_arrivals: if True, the node schedules its own packet
+        arrivals. Otherwise, they are generated by another module calling
+        packet_arrival()
+        :param index: position of the node in the list of nodes, used to find
+        its arrivals in a trace
         """
-        Module.__init__(self)
+        Module.__init__(self, sim)
         # load configuration parameters
         self.datarate = config.get_param(Node.DATARATE)
         self.queue_size = config.get_param(Node.QUEUE)
-        self.interarrival = Distribution(config.get_param(Node.INTERARRIVAL))
-        self.size = Distribution(config.get_param(Node.SIZE))
-        self.proc_time = Distribution(config.get_param(Node.PROC_TIME))
+        # generator of the arrivals, also used to place skipped arrivals
+        self.arrival_rng = sim.get_rng(self, Node.STREAM_ARRIVAL)
+        self.interarrival = Distribution(config.get_param(Node.INTERARRIVAL), self.arrival_rng, index)
+        if self.interarrival.is_trace():
+            # arrivals replayed from a trace, together with their sizes
+            self.size = self.interarrival.get_trace_sizes()
+        else:
+            self.size = Distribution(config.get_param(Node.SIZE), sim.get_rng(self, Node.STREAM_SIZE))
+        self.proc_time = Distribution(config.get_param(Node.PROC_TIME), sim.get_rng(self, Node.STREAM_PROCESSING))
         self.maxsize = config.get_param(Node.MAXSIZE)
+        # random variables used by the protocols: the probability of correct
+        # reception, the persistence, and the time waited before sensing the
+        # channel again
+        self.reception = Uniform(0, 1, rng=sim.get_rng(self, Node.STREAM_RECEPTION))
+        self.persistence_draw = Uniform(0, 1, rng=sim.get_rng(self, Node.STREAM_PERSISTENCE))
+        self.backoff = Exp(10 * self.maxsize * 8.0 / self.datarate, rng=sim.get_rng(self, Node.STREAM_BACKOFF))
+        # importance sampling: draw arrivals and waiting times with biased
+        # rates, accumulating the likelihood ratio in the simulation
+        if sim.arrival_bias != 1:
+            self.interarrival.set_bias(sim.arrival_bias, sim)
+        if sim.backoff_bias != 1:
+            self.backoff = BiasedExp(10 * self.maxsize * 8.0 / self.datarate, sim.backoff_bias, sim,
+                                     self.backoff.rng)
         # queue of packets to be sent
         self.queue = []
         # current state
@@ -108,38 +156,59 @@ class Node(Module):
         self.wt_timeout = None
         # skip sensing when coming from IDLE, in case of sensing protocols
         self.skip_sensing = config.skip_sensing()
+        self.own_arrivals = own_arrivals
+        # with exponential interarrival times, stop scheduling arrivals while
+        # the queue is full, and account for the dropped packets in one step
+        # when it frees up
+        self.skip_rate = None
+        if own_arrivals and config.get_optional_param(Node.SKIP_BLOCKED_ARRIVALS, False):
+            self.skip_rate = ArrivalSource.get_rate(self.interarrival)
+        # with buffered variates, every random variable of the node is a
+        # separate stream drawing a block of values from the generator of the
+        # simulation when it runs out. the simulation is reproducible, but
+        # gives different values than drawing one value at a time
+        block_size = config.get_optional_param(Node.BUFFERED_VARIATES, False)
+        if block_size:
+            if block_size is True:
+                block_size = Buffered.BLOCK_SIZE
+            # arrivals replayed from a trace are read from memory already, and
+            # a block could go past the end of the trace
+            if not self.interarrival.is_trace():
+                # biased values update the likelihood ratio when drawn: they
+                # must be drawn when used, so that each logged event has the
+                # weight of the values it depends on
+                if sim.arrival_bias == 1:
+                    self.interarrival = Buffered(self.interarrival, block_size)
+                self.size = Buffered(self.size, block_size)
+            self.proc_time = Buffered(self.proc_time, block_size)
+            self.reception = Buffered(self.reception, block_size)
+            self.persistence_draw = Buffered(self.persistence_draw, block_size)
+            if sim.backoff_bias == 1:
+                self.backoff = Buffered(self.backoff, block_size)
+        # time since which arrivals are not scheduled because the queue is
+        # full, None if they are
+        self.blocked_since = None
+        # register the handlers for the events this node receives
+        self.register_handler(Events.PACKET_ARRIVAL, self.handle_arrival)
+        self.register_handler(Events.START_RX, self.handle_start_rx)
+        self.register_handler(Events.END_RX, self.handle_end_rx)
+        self.register_handler(Events.END_TX, self.handle_end_tx)
+        self.register_handler(Events.END_PROC, self.handle_end_proc)
+        self.register_handler(Events.RX_TIMEOUT, self.handle_rx_timeout)
+        self.register_handler(Events.END_SENSING, self.handle_end_sensing)
+        self.register_handler(Events.WT_TIMEOUT, self.handle_wt_timeout)
+        # events always scheduled with the same delay, the same for all nodes
+        sim.add_fixed_delay(Events.END_SENSING)
+        sim.add_fixed_delay(Events.RX_TIMEOUT)
+        if self.proc_time.is_constant():
+            sim.add_fixed_delay(Events.END_PROC)
 
     def initialize(self):
         """
         Initialization. Starts node operation by scheduling the first packet
         """
-        self.schedule_next_arrival()
-
-    def handle_event(self, event):
-        """
-        Handles events notified to the node
-        :param event: the event
-        """
-        if event.get_type() == Events.PACKET_ARRIVAL:
-            self.handle_arrival()
-        elif event.get_type() == Events.START_RX:
-            self.handle_start_rx(event)
-        elif event.get_type() == Events.END_RX:
-            self.handle_end_rx(event)
-        elif event.get_type() == Events.END_TX:
-            self.handle_end_tx(event)
-        elif event.get_type() == Events.END_PROC:
-            self.handle_end_proc(event)
-        elif event.get_type() == Events.RX_TIMEOUT:
-            self.handle_rx_timeout(event)
-        elif event.get_type() == Events.END_SENSING:
-            self.handle_end_sensing(event)
-        elif event.get_type() == Events.WT_TIMEOUT:
-            self.handle_wt_timeout(event)
-        else:
-            print("Node %d has received a notification for event type %d which"
-                  " can't be handled", (self.get_id(), event.get_type()))
-            sys.exit(1)
+        if self.own_arrivals:
+            self.schedule_next_arrival()
 
     def schedule_next_arrival(self):
         """
@@ -147,9 +216,12 @@ class Node(Module):
         """
         # extract random value for next arrival
         arrival = self.interarrival.get_value()
+        if arrival == Node.NO_ARRIVAL:
+            # the trace is over
+            return
         # generate an event setting this node as destination
-        event = Event(self.sim.get_time() + arrival, Events.PACKET_ARRIVAL,
-                      self, self)
+        event = self.sim.new_event(self.sim.get_time() + arrival, Events.PACKET_ARRIVAL,
+                                   self, self)
         self.sim.schedule_event(event)
 
     def enter_sensing(self):
@@ -158,14 +230,62 @@ class Node(Module):
         """
         assert (self.protocol == Node.TRIVIAL_CARRIER_SENSING or self.protocol == Node.SIMPLE_CARRIER_SENSING)
         assert (not self.is_sensing())
-        self.end_sensing = Event(self.sim.get_time() + Node.SENSE_TIME, Events.END_SENSING, self, self)
+        self.end_sensing = self.sim.new_event(self.sim.get_time() + Node.SENSE_TIME, Events.END_SENSING, self, self)
         self.sim.schedule_event(self.end_sensing)
         self.state = Node.SENSING
         self.logger.log_state(self, Node.SENSING)
 
-    def handle_arrival(self):
+    def handle_arrival(self, event):
         """
         Handles a packet arrival
+        :param event: the PACKET_ARRIVAL event
+        """
+        self.packet_arrival()
+        if self.skip_rate is not None and self.queue_is_full():
+            # all arrivals until the queue frees up are dropped: skip them
+            self.blocked_since = self.sim.get_time()
+        else:
+            # schedule next arrival
+            self.schedule_next_arrival()
+
+    def queue_is_full(self):
+        """
+        Returns True if an arrival would be dropped
+        """
+        return self.state != Node.IDLE and self.queue_size != 0 and len(self.queue) >= self.queue_size
+
+    def skip_arrivals(self):
+        """
+        Accounts for the arrivals skipped since the queue got full. As
+        interarrival times are exponential, their number is a Poisson variable
+        with mean rate * elapsed time, and given their number, their times are
+        independent and uniformly distributed over the interval. They are
+        logged now, after lines of other nodes with later times, so the output
+        file is not sorted by time, while the arrivals of this node still are.
+        Their sizes are drawn now as well, in order of arrival time
+        """
+        start = self.blocked_since
+        now = self.sim.get_time()
+        count = poisson(self.skip_rate * (now - start), self.arrival_rng)
+        if count > 0 and (self.logger.log_arrivals or self.logger.log_queue_drops):
+            rng = self.arrival_rng
+            for t in sorted(rng.uniform(start, now) for _ in range(count)):
+                packet_size = self.size.get_value()
+                self.logger.log_arrival(self, packet_size, t)
+                self.logger.log_queue_drop(self, packet_size, t)
+        self.blocked_since = now
+
+    def finalize(self):
+        """
+        Accounts for the arrivals skipped until the end of the simulation
+        """
+        if self.blocked_since is not None:
+            self.skip_arrivals()
+
+    def packet_arrival(self):
+        """
+        Processes the arrival of a new packet, either transmitting it or
+        queueing it
         """
         # draw packet size from the distribution
         packet_size = self.size.get_value()
@@ -193,8 +313,6 @@ class Node(Module):
             else:
                 # if there is no space left, we drop the packet and log
                 self.logger.log_queue_drop(self, packet_size)
-        # schedule next arrival
-        self.schedule_next_arrival()
 
     def handle_start_rx(self, event):
         """
@@ -202,6 +320,18 @@ class Node(Module):
         :param event: the RX event including the frame being received
         """
         new_packet = event.get_obj()
+        self.start_rx(new_packet)
+        # in any case, we schedule a new event to handle the end of this frame
+        end_rx = self.sim.new_event(self.sim.get_time() + new_packet.get_duration(),
+                                    Events.END_RX, self, self, new_packet)
+        self.sim.schedule_event(end_rx)
+
+    def start_rx(self, new_packet):
+        """
+        Processes the beginning of a frame reception. The end of the reception
+        must be notified by calling end_rx() after the duration of the packet
+        :param new_packet: the frame being received
+        """
         if self.state == Node.IDLE:
             if self.receiving_count == 0:
                 # node is idle: it will try to receive this packet
@@ -240,10 +370,6 @@ class Node(Module):
             # the same holds for the new incoming packet. either if we are in
             # the RX, TX, or PROC state, we won't be able to decode it
             new_packet.set_state(Packet.PKT_CORRUPTED)
-        # in any case, we schedule a new event to handle the end of this frame
-        end_rx = Event(self.sim.get_time() + new_packet.get_duration(),
-                       Events.END_RX, self, self, new_packet)
-        self.sim.schedule_event(end_rx)
         # count this as currently being received
         self.receiving_count = self.receiving_count + 1
 
@@ -252,10 +378,16 @@ class Node(Module):
         Handles the end of a reception
         :param event: the END_RX event
         """
+        self.end_rx(event.get_obj())
+
+    def end_rx(self, packet):
+        """
+        Processes the end of a frame reception
+        :param packet: the frame whose reception ends
+        """
         # in case of carrier sensing, the node can't be in idle state. carrier sensing => not idle
         assert (self.protocol != Node.TRIVIAL_CARRIER_SENSING or self.state != Node.IDLE)
         assert (self.protocol != Node.SIMPLE_CARRIER_SENSING or self.state != Node.IDLE)
-        packet = event.get_obj()
         # if the packet that ends is the one that we are trying to receive, but
         # we are not in the RX state, then something is very wrong
         if self.current_pkt is not None and \
@@ -266,7 +398,7 @@ class Node(Module):
                 # using the realistic propagation: extract a random number between 0 and 1 and decide what to do
                 # in case of disk reception model, the probability of correct reception is 1, so the node will
                 # always receive it
-                random = Uniform(0, 1).get_value()
+                random = self.reception.get_value()
                 if random <= packet.correct_reception_probability:
                     # standard reception
                     # the packet is not in a corrupted state: we succesfully
@@ -305,15 +437,15 @@ class Node(Module):
                 self.handle_transmission()
         self.receiving_count = self.receiving_count - 1
         # log packet
-        self.logger.log_packet(event.get_source(), self, packet)
+        self.logger.log_packet(self, self, packet)
 
     def switch_to_proc(self):
         """
         Switches to the processing state and schedules the end_proc event
         """
         proc_time = self.proc_time.get_value()
-        proc = Event(self.sim.get_time() + proc_time, Events.END_PROC, self,
-                     self)
+        proc = self.sim.new_event(self.sim.get_time() + proc_time, Events.END_PROC, self,
+                                  self)
         self.sim.schedule_event(proc)
         self.state = Node.PROC
         self.logger.log_state(self, Node.PROC)
@@ -370,11 +502,11 @@ class Node(Module):
         assert(self.current_pkt is None)
         duration = packet_size * 8 / self.datarate
         # transmit packet
-        packet = Packet(packet_size, duration)
+        packet = self.sim.new_packet(packet_size, duration)
         self.channel.start_transmission(self, packet)
         # schedule end of transmission
-        end_tx = Event(self.sim.get_time() + duration, Events.END_TX, self,
-                       self, packet)
+        end_tx = self.sim.new_event(self.sim.get_time() + duration, Events.END_TX, self,
+                                    self, packet)
         self.sim.schedule_event(end_tx)
         self.current_pkt = packet
 
@@ -401,8 +533,8 @@ class Node(Module):
         assert (self.state == Node.WT)
         assert (self.end_sensing is None)
         assert (self.wt_timeout is None)
-        event_time = Exp(10 * self.maxsize * 8.0 / self.datarate).get_value()
-        self.wt_timeout = Event(self.sim.get_time() + event_time, Events.WT_TIMEOUT, self, self)
+        event_time = self.backoff.get_value()
+        self.wt_timeout = self.sim.new_event(self.sim.get_time() + event_time, Events.WT_TIMEOUT, self, self)
         self.sim.schedule_event(self.wt_timeout)
 
     def handle_transmission(self):
@@ -410,6 +542,12 @@ class Node(Module):
         Wrapper to handle the transmission of a packet
         """
         packet_size = self.queue.pop(0)
+        if self.blocked_since is not None:
+            # there is space in the queue again: resume arrivals. by the
+            # memoryless property, the next one is an exponential time from now
+            self.skip_arrivals()
+            self.blocked_since = None
+            self.schedule_next_arrival()
         self.transmit_packet(packet_size)
         self.state = Node.TX
         self.logger.log_state(self, Node.TX)
@@ -427,9 +565,9 @@ class Node(Module):
         self.state = Node.RX
         assert (self.timeout_event is None)
         # create and schedule the RX timeout
-        self.timeout_event = Event(self.sim.get_time() +
-                                   self.timeout_time, Events.RX_TIMEOUT,
-                                   self, self, None)
+        self.timeout_event = self.sim.new_event(self.sim.get_time() +
+                                                self.timeout_time, Events.RX_TIMEOUT,
+                                                self, self, None)
         self.sim.schedule_event(self.timeout_event)
         self.logger.log_state(self, Node.RX)
 
@@ -453,8 +591,7 @@ class Node(Module):
                 self.handle_transmission()
         elif self.protocol == Node.SIMPLE_CARRIER_SENSING and len(self.queue) > 0:
             # with simple cs and the channel busy, the node generates a random number and decides what to do
-            random = Uniform(0, 1).get_value()
-            if random > self.persistence:
+            if not self.persists():
                 # delay the transmission and move to WT
                 self.state = Node.WT
                 self.logger.log_state(self, Node.WT)
@@ -472,8 +609,7 @@ class Node(Module):
             self.handle_transmission()
         else:
             # generate random number and decide what to do
-            random = Uniform(0, 1).get_value()
-            if random > self.persistence:
+            if not self.persists():
                 # the node remains in this state and schedule the new transmission
                 self.schedule_wt_timeout()
             else:
@@ -481,6 +617,33 @@ class Node(Module):
                 self.state = Node.SENSING
                 self.logger.log_state(self, Node.SENSING)
 
+    def uses_persistence(self, event):
+        """
+        Tells whether processing an event makes the node draw the persistence,
+        following the same conditions of handle_end_sensing() and
+        handle_wt_timeout()
+        :param event: an event for this node
+        :returns: True if the handler of the event calls persists()
+        """
+        if self.protocol != Node.SIMPLE_CARRIER_SENSING or self.receiving_count == 0:
+            return False
+        if event.event_type == Events.END_SENSING:
+            return len(self.queue) > 0
+        return event.event_type == Events.WT_TIMEOUT
+
+    def persists(self):
+        """
+        Draws a random number to decide whether the node keeps sensing the
+        channel (1-persistent behaviour) or waits for a random time
+        :returns: True with probability equal to the persistence
+        """
+        # the persistence is what differs among the variants of a simulation
+        # sharing the same prefix: the prefix must stop before this event,
+        # see uses_persistence()
+        if self.sim.shared_prefix:
+            raise VariantDivergence()
+        return self.persistence_draw.get_value() <= self.persistence
+
     def is_sensing(self):
         """
         True if the node is sensing the channel, false otherwise
@@ -18,9 +18,9 @@ class Packet:
     """
     Class defining a packet to be associated with a transmission event
     """
-
-    # used to create a unique ID for the packet
-    __packets_count = 0
+    # one packet is created for every transmission: slots avoid the
+    # per-instance dictionary
+    __slots__ = ("size", "duration", "state", "id", "correct_reception_probability")
 
     # possible packet states
     # packet currently under reception
@@ -32,17 +32,17 @@ class Packet:
     # in case of realistic propagation, the packet can be corrupted by the channel
     PKT_CORRUPTED_BY_CHANNEL = 3
 
-    def __init__(self, size, duration):
+    def __init__(self, size, duration, packet_id):
         """
-        Creates a packet automatically assigning a unique ID to it
+        Creates a packet
         :param size: size of the packet in bytes
         :param duration: packet duration in seconds
+        :param packet_id: unique ID of the packet, assigned by the simulation
         """
         self.size = size
         self.duration = duration
         self.state = Packet.PKT_RECEIVING
-        self.id = Packet.__packets_count
-        Packet.__packets_count = Packet.__packets_count + 1
+        self.id = packet_id
         self.correct_reception_probability = 1.0
 
     def get_id(self):
@@ -95,3 +95,60 @@ class Packet:
         else:
             ValueError("State not supported")
         print("Packet state: %s\n\n" % t)
+
+
+class Reception:
+    """
+    Reception of a packet by a neighbor of the transmitter. Every receiver
+    processes the packet in its own way, so the state of the reception and
+    its probability of success belong to the receiver, while the packet
+    itself, with its id, size and duration, is shared by all receptions.
+    A reception can be used wherever a received packet is expected
+    """
+    __slots__ = ("packet", "state", "correct_reception_probability")
+
+    def __init__(self, packet, correct_reception_probability):
+        """
+        Creates a reception
+        :param packet: the packet being transmitted
+        :param correct_reception_probability: probability that the receiver
+        gets the packet if no collision occurs
+        """
+        self.packet = packet
+        self.state = packet.state
+        self.correct_reception_probability = correct_reception_probability
+
+    def get_id(self):
+        """
+        Returns packet id
+        :returns: id of the packet
+        """
+        return self.packet.id
+
+    def get_state(self):
+        """
+        Returns state of the reception
+        :returns: state of the reception
+        """
+        return self.state
+
+    def set_state(self, state):
+        """
+        Sets reception state.
+        :param state: either PKT_RECEIVING, PKT_RECEIVED, or PKT_CORRUPTED
+        """
+        self.state = state
+
+    def get_size(self):
+        """
+        Returns packet size
+        :returns: packet size in bytes
+        """
+        return self.packet.size
+
+    def get_duration(self):
+        """
+        Returns packet duration
+        :returns: packet duration in seconds
+        """
+        return self.packet.duration
@@ -0,0 +1,234 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import division, absolute_import
+import time
+
+from events import Events
+
+
+def event_name(event_type):
+    """
+    Returns the name of an event type, as defined in Events
+    :param event_type: the type of event
+    :returns: the name of the constant, or the number itself if unknown
+    """
+    for name, value in vars(Events).items():
+        if not name.startswith("_") and value == event_type:
+            return name
+    return str(event_type)
+
+
+class Timing:
+    """
+    Wall time statistics of a function: number of calls, total and maximum
+    time, and a histogram of the durations with power of two buckets in
+    microseconds
+    """
+
+    # number of buckets of the histogram. the last one collects all calls
+    # longer than 2^(BUCKETS - 2) microseconds
+    BUCKETS = 16
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.histogram = [0] * self.BUCKETS
+
+    def add(self, duration):
+        """
+        Records a call
+        :param duration: duration of the call in seconds
+        """
+        self.calls += 1
+        self.total += duration
+        if duration > self.max:
+            self.max = duration
+        # bucket i holds durations in [2^(i-1), 2^i) microseconds
+        bucket = int(duration * 1e6).bit_length()
+        self.histogram[min(bucket, self.BUCKETS - 1)] += 1
+
+    def percentile(self, p):
+        """
+        Returns an upper bound of a percentile of the durations, given by the
+        histogram bucket it falls in
+        :param p: the percentile, between 0 and 1
+        :returns: the upper bound in seconds
+        """
+        count = 0
+        for i, c in enumerate(self.histogram):
+            count += c
+            if count >= p * self.calls:
+                return (1 << i) / 1e6
+        return self.max
+
+
+class TimedCall:
+    """
+    Wraps a method so that its wall time is recorded. The method is stored as
+    object and function rather than as a bound method, so that wrappers can
+    be pickled together with the simulation when saving a checkpoint
+    """
+
+    def __init__(self, timing, obj, function, event_type=None, counts=None):
+        """
+        Constructor.
+        :param timing: the Timing where durations are recorded
+        :param obj: the object the method is called on
+        :param function: the function implementing the method
+        :param event_type: for event handlers, the type of event handled
+        :param counts: for event handlers, the map from event type to number
+        of events where the call is counted
+        """
+        self.timing = timing
+        self.obj = obj
+        self.function = function
+        self.event_type = event_type
+        self.counts = counts
+
+    def __call__(self, *args):
+        if self.counts is not None:
+            self.counts[self.event_type] += 1
+        start = time.perf_counter()
+        result = self.function(self.obj, *args)
+        self.timing.add(time.perf_counter() - start)
+        return result
+
+
+class QueueMonitor:
+    """
+    Wraps the schedule() and cancel() methods of a scheduler to record the
+    maximum number of entries in the queue and the number of cancellations
+    """
+
+    def __init__(self, profiler, scheduler, function, cancel):
+        """
+        Constructor.
+        :param profiler: the profiler where statistics are recorded
+        :param scheduler: the scheduler being monitored
+        :param function: the function implementing the wrapped method
+        :param cancel: True if the wrapped method is cancel()
+        """
+        self.profiler = profiler
+        self.scheduler = scheduler
+        self.function = function
+        self.cancel = cancel
+
+    def __call__(self, event):
+        profiler = self.profiler
+        self.function(self.scheduler, event)
+        if self.cancel:
+            profiler.cancellations += 1
+        else:
+            profiler.scheduled += 1
+            entries = self.scheduler.entries()
+            if entries > profiler.max_entries:
+                profiler.max_entries = entries
+            pending = len(self.scheduler)
+            if pending > profiler.max_pending:
+                profiler.max_pending = pending
+
+
+class Profiler:
+    """
+    Collects statistics about where the time of a simulation goes: number of
+    events per type, wall time of event handlers, of channel transmissions
+    and of logging, size of the queue of events and number of cancellations.
+    Statistics are collected by wrapping the methods of the simulation
+    objects, so the simulation loop itself is untouched and profiling costs
+    nothing when disabled. Times are inclusive: the time of a handler
+    includes the time spent logging and transmitting within the handler
+    """
+
+    # logger methods being timed
+    LOG_METHODS = ["log_packet", "log_queue_drop", "log_arrival", "log_queue_length", "log_state"]
+
+    def __init__(self):
+        # number of processed events, per event type
+        self.counts = {}
+        # timings, per wrapped method name
+        self.timings = {}
+        # queue statistics
+        self.scheduled = 0
+        self.cancellations = 0
+        self.max_entries = 0
+        self.max_pending = 0
+
+    def get_timing(self, name):
+        """
+        Returns the timing of a method, creating it if needed
+        :param name: name of the method
+        """
+        if name not in self.timings:
+            self.timings[name] = Timing()
+        return self.timings[name]
+
+    def wrap(self, obj, name):
+        """
+        Replaces a method of an object with a timed wrapper
+        :param obj: the object
+        :param name: name of the method
+        """
+        function = getattr(type(obj), name)
+        timing = self.get_timing("%s.%s" % (type(obj).__name__, name))
+        setattr(obj, name, TimedCall(timing, obj, function))
+
+    def install(self, sim):
+        """
+        Wraps the methods of an initialized simulation
+        :param sim: the simulation to profile
+        """
+        for module in sim.get_modules():
+            for event_type, handler in module.handlers.items():
+                self.counts.setdefault(event_type, 0)
+                timing = self.get_timing("%s.%s" % (type(module).__name__, handler.__name__))
+                module.handlers[event_type] = TimedCall(timing, handler.__self__, handler.__func__,
+                                                        event_type, self.counts)
+        self.wrap(sim.channel, "start_transmission")
+        for name in self.LOG_METHODS:
+            self.wrap(sim.logger, name)
+        queue = sim.queue
+        # events scheduled while initializing the nodes
+        self.scheduled = len(queue)
+        self.max_entries = queue.entries()
+        self.max_pending = len(queue)
+        queue.schedule = QueueMonitor(self, queue, type(queue).schedule, False)
+        queue.cancel = QueueMonitor(self, queue, type(queue).cancel, True)
+
+    def summary(self, wall_time):
+        """
+        Returns a textual summary of the statistics
+        :param wall_time: wall time of the whole simulation in seconds, used
+        to compute the share of each method
+        :returns: the summary, as a multi-line string
+        """
+        lines = []
+        total = sum(self.counts.values())
+        lines.append("events: %d" % total)
+        for event_type, count in sorted(self.counts.items(), key=lambda c: -c[1]):
+            if count > 0:
+                lines.append("  %-16s %12d %6.1f%%" % (event_name(event_type), count, 100 * count / total))
+        lines.append("wall time: %.3f s" % wall_time)
+        lines.append("  %-31s %10s %9s %7s %9s %9s %9s" %
+                     ("method", "calls", "total[s]", "share", "mean[us]", "p99[us]", "max[us]"))
+        for name, t in sorted(self.timings.items(), key=lambda t: -t[1].total):
+            if t.calls > 0:
+                lines.append("  %-31s %10d %9.3f %6.1f%% %9.2f %9.0f %9.0f" %
+                             (name, t.calls, t.total, 100 * t.total / wall_time if wall_time > 0 else 0,
+                              1e6 * t.total / t.calls, 1e6 * t.percentile(0.99), 1e6 * t.max))
+        lines.append("queue: %d scheduled, %d canceled (%.1f%%), max %d entries, max %d pending" %
+                     (self.scheduled, self.cancellations,
+                      100 * self.cancellations / self.scheduled if self.scheduled > 0 else 0,
+                      self.max_entries, self.max_pending))
+        return "\n".join(lines)
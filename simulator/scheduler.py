@@ -0,0 +1,539 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import division, absolute_import
+import heapq
+import bisect
+import struct
+from collections import deque
+
+
+# packs a float into its IEEE 754 binary representation
+DOUBLE = struct.Struct("<d")
+
+
+class Scheduler:
+    """
+    Defines the interface of the future event set used by the simulation.
+    Events are returned in increasing time order and, for events scheduled at
+    exactly the same time, in increasing id order. All implementations must
+    follow this ordering, so that the results of a simulation do not depend on
+    the scheduler being used.
+    Canceled events are not removed immediately: they are marked as not
+    pending and discarded when they reach the front of the queue
+    """
+
+    # the queue is compacted when canceled events make up more than this
+    # fraction of its entries
+    COMPACTION_RATIO = 0.5
+    # minimum number of canceled events before compacting the queue, to avoid
+    # rebuilding tiny queues over and over
+    COMPACTION_MIN_CANCELED = 64
+
+    def __init__(self):
+        # number of canceled events still stored in the queue
+        self.canceled = 0
+        # number of ticks per second when the simulation uses an integer time
+        # base, None otherwise
+        self.resolution = None
+
+    def set_resolution(self, resolution):
+        """
+        Informs the scheduler that all event times are multiples of
+        1 / resolution seconds, so that they can be handled as integer ticks
+        :param resolution: number of ticks per second
+        """
+        self.resolution = resolution
+
+    def schedule(self, event):
+        """
+        Inserts an event in the queue
+        :param event: the event to schedule
+        """
+        raise NotImplementedError()
+
+    def pop(self):
+        """
+        Removes and returns the first pending event of the queue
+        :returns: the first event, or None if the queue is empty
+        """
+        raise NotImplementedError()
+
+    def peek(self):
+        """
+        Returns the first pending event of the queue without removing it
+        :returns: the first event, or None if the queue is empty
+        """
+        raise NotImplementedError()
+
+    def add_lane(self, event_type):
+        """
+        Declares that events of a type are always scheduled with the same delay
+        after the current time, so that they are scheduled in time order.
+        Schedulers can use this to store them more efficiently. By default, the
+        declaration is ignored
+        :param event_type: the type of event
+        """
+        pass
+
+    def cancel(self, event):
+        """
+        Cancels a pending event. The event is discarded when it reaches the
+        front of the queue, or when the queue gets compacted
+        :param event: the event to cancel
+        """
+        event.pending = False
+        self.canceled += 1
+        if self.canceled >= self.COMPACTION_MIN_CANCELED and \
+           self.canceled > self.entries() * self.COMPACTION_RATIO:
+            self.compact()
+
+    def compact(self):
+        """
+        Removes all canceled events from the queue
+        """
+        raise NotImplementedError()
+
+    def entries(self):
+        """
+        Returns the number of entries stored in the queue, including canceled
+        events that have not been discarded yet
+        """
+        raise NotImplementedError()
+
+    def __len__(self):
+        """
+        Returns the number of pending events
+        """
+        return self.entries() - self.canceled
+
+
+class HeapScheduler(Scheduler):
+    """
+    Binary heap scheduler, based on the heapq module. The heap stores
+    (time, id, event) tuples rather than events, so that all comparisons are
+    done by the interpreter on floats and integers, without calling
+    Event.__lt__. Ids are unique, so events themselves are never compared
+    """
+
+    def __init__(self):
+        Scheduler.__init__(self)
+        self.heap = []
+
+    def schedule(self, event):
+        event.pending = True
+        heapq.heappush(self.heap, (event.event_time, event.event_id, event))
+
+    def pop(self):
+        heap = self.heap
+        while heap:
+            event = heapq.heappop(heap)[2]
+            if event.pending:
+                event.pending = False
+                return event
+            self.canceled -= 1
+        return None
+
+    def peek(self):
+        heap = self.heap
+        while heap:
+            event = heap[0][2]
+            if event.pending:
+                return event
+            heapq.heappop(heap)
+            self.canceled -= 1
+        return None
+
+    def compact(self):
+        self.heap = [e for e in self.heap if e[2].pending]
+        heapq.heapify(self.heap)
+        self.canceled = 0
+
+    def entries(self):
+        return len(self.heap)
+
+
+class LaneScheduler(HeapScheduler):
+    """
+    Binary heap scheduler with FIFO lanes for events scheduled with a
+    constant delay. Such events are scheduled in time order, so each lane is a
+    plain deque, sorted by construction, with O(1) insertion and removal. Pop
+    merges the first entry of the heap with the first entry of each lane.
+    An event is only added to its lane if it does not precede the last event
+    of the lane, otherwise it goes to the heap, so the ordering is correct
+    even if the delay of a declared type is not really constant
+    """
+
+    def __init__(self):
+        HeapScheduler.__init__(self)
+        # lanes by event type, and as a list for merging
+        self.lanes = {}
+        self.lane_list = []
+
+    def add_lane(self, event_type):
+        if event_type not in self.lanes:
+            lane = deque()
+            self.lanes[event_type] = lane
+            self.lane_list.append(lane)
+
+    def schedule(self, event):
+        event.pending = True
+        entry = (event.event_time, event.event_id, event)
+        lane = self.lanes.get(event.event_type)
+        if lane is not None and (not lane or lane[-1] < entry):
+            lane.append(entry)
+        else:
+            heapq.heappush(self.heap, entry)
+
+    def first(self):
+        """
+        Finds the first entry of the queue, including canceled ones
+        :returns: the entry and the lane holding it, None if it is in the heap.
+        The entry is None if the queue is empty
+        """
+        first = self.heap[0] if self.heap else None
+        first_lane = None
+        for lane in self.lane_list:
+            if lane and (first is None or lane[0] < first):
+                first = lane[0]
+                first_lane = lane
+        return first, first_lane
+
+    def pop(self):
+        while True:
+            entry, lane = self.first()
+            if entry is None:
+                return None
+            if lane is None:
+                heapq.heappop(self.heap)
+            else:
+                lane.popleft()
+            event = entry[2]
+            if event.pending:
+                event.pending = False
+                return event
+            self.canceled -= 1
+
+    def peek(self):
+        while True:
+            entry, lane = self.first()
+            if entry is None:
+                return None
+            event = entry[2]
+            if event.pending:
+                return event
+            if lane is None:
+                heapq.heappop(self.heap)
+            else:
+                lane.popleft()
+            self.canceled -= 1
+
+    def compact(self):
+        for lane in self.lane_list:
+            pending = [e for e in lane if e[2].pending]
+            lane.clear()
+            lane.extend(pending)
+        HeapScheduler.compact(self)
+
+    def entries(self):
+        return len(self.heap) + sum(len(lane) for lane in self.lane_list)
+
+
+class RadixHeap(Scheduler):
+    """
+    Radix heap scheduler (R. Ahuja, K. Mehlhorn, J. Orlin and R. Tarjan,
+    "Faster algorithms for the shortest path problem", 1990). It works on
+    integer keys and requires the queue to be monotone, i.e., no key smaller
+    than the last extracted one can be inserted, which holds since events are
+    never scheduled in the past. An entry is stored in the bucket given by
+    the highest bit in which its key differs from the last extracted key.
+    When the bucket of the keys equal to the last one empties, the next
+    non-empty bucket is redistributed into the lower ones, so that each entry
+    moves at most once per bit.
+    Keys are integer ticks when the simulation uses an integer time base, or
+    the binary representation of the event time otherwise, which has the
+    same ordering as the time itself for non-negative floats
+    """
+
+    # number of buckets: one for keys equal to the last one, plus one per bit
+    # of a 64 bit key
+    BUCKETS = 65
+
+    def __init__(self):
+        Scheduler.__init__(self)
+        # bucket 0 holds entries whose key is equal to last, and is a heap of
+        # (id, event). the other buckets are unsorted lists of
+        # (key, id, event)
+        self.buckets = [[] for _ in range(self.BUCKETS)]
+        # last extracted key. all keys in the queue are greater or equal
+        self.last = 0
+        # number of entries in the queue, including canceled ones
+        self.size = 0
+
+    def insert(self, entry):
+        """
+        Stores a (key, id, event) entry in its bucket
+        """
+        diff = entry[0] ^ self.last
+        if diff == 0:
+            heapq.heappush(self.buckets[0], (entry[1], entry[2]))
+        else:
+            self.buckets[diff.bit_length()].append(entry)
+
+    def schedule(self, event):
+        event.pending = True
+        if self.resolution is None:
+            key = int.from_bytes(DOUBLE.pack(event.event_time), "little")
+        else:
+            key = int(round(event.event_time * self.resolution))
+        if key < self.last:
+            # only happens if peek() moved past the current time: go back
+            self.rebuild(key)
+        # compute the key, and store the entry as insert() does. inlined, as
+        # this is called for every event
+        diff = key ^ self.last
+        if diff == 0:
+            heapq.heappush(self.buckets[0], (event.event_id, event))
+        else:
+            self.buckets[diff.bit_length()].append((key, event.event_id, event))
+        self.size += 1
+
+    def refill(self):
+        """
+        Moves the entries with the smallest key to bucket 0, redistributing
+        the first non-empty bucket. The queue must not be empty
+        """
+        buckets = self.buckets
+        i = 1
+        while not buckets[i]:
+            i += 1
+        entries = buckets[i]
+        buckets[i] = []
+        self.last = min(entries)[0]
+        for entry in entries:
+            self.insert(entry)
+
+    def pop(self):
+        bucket = self.buckets[0]
+        while self.size > 0:
+            if not bucket:
+                self.refill()
+            event = heapq.heappop(bucket)[1]
+            self.size -= 1
+            if event.pending:
+                event.pending = False
+                return event
+            self.canceled -= 1
+        return None
+
+    def peek(self):
+        bucket = self.buckets[0]
+        while self.size > 0:
+            if not bucket:
+                self.refill()
+            event = bucket[0][1]
+            if event.pending:
+                return event
+            heapq.heappop(bucket)
+            self.size -= 1
+            self.canceled -= 1
+        return None
+
+    def rebuild(self, last):
+        """
+        Redistributes all pending entries with respect to a new last key.
+        Canceled events are dropped in the process
+        :param last: the new last key, smaller or equal to all keys
+        """
+        last_key = self.last
+        entries = [(last_key, e[0], e[1]) for e in self.buckets[0] if e[1].pending]
+        for bucket in self.buckets[1:]:
+            entries.extend(e for e in bucket if e[2].pending)
+        self.buckets = [[] for _ in range(self.BUCKETS)]
+        self.last = last
+        for entry in entries:
+            self.insert(entry)
+        self.size = len(entries)
+        self.canceled = 0
+
+    def compact(self):
+        self.rebuild(self.last)
+
+    def entries(self):
+        return self.size
+
+
+class CalendarQueue(Scheduler):
+    """
+    Calendar queue scheduler (R. Brown, "Calendar queues: a fast O(1) priority
+    queue implementation for the simulation event set problem", 1988).
+    Time is divided into slots of fixed width, and each slot is mapped onto one
+    of the buckets of the calendar, like days onto a one-year calendar. Each
+    bucket keeps its events sorted. The number of buckets and their width are
+    adapted to the number of events and to their spacing, so that each bucket
+    holds few events and most operations only touch a single bucket
+    """
+
+    # minimum number of buckets
+    MIN_BUCKETS = 2
+    # number of events sampled to estimate the bucket width
+    WIDTH_SAMPLES = 25
+
+    def __init__(self, buckets=MIN_BUCKETS, width=1.0):
+        """
+        Constructor.
+        :param buckets: initial number of buckets
+        :param width: initial width of a bucket in seconds
+        """
+        Scheduler.__init__(self)
+        self.width = width
+        self.buckets = [[] for _ in range(buckets)]
+        # number of entries in the calendar, including canceled ones
+        self.size = 0
+        # time of the last event popped from the queue. no event can be
+        # scheduled before this time, so no event is stored in a time slot
+        # preceding the one of last_time
+        self.last_time = 0
+        # index of the time slot of last_time
+        self.slot = 0
+
+    def schedule(self, event):
+        event.pending = True
+        t = event.event_time
+        bisect.insort(self.buckets[int(t / self.width) % len(self.buckets)],
+                      (t, event.event_id, event))
+        self.size += 1
+        if self.size > 2 * len(self.buckets):
+            self.resize(2 * len(self.buckets))
+
+    def find(self):
+        """
+        Finds the bucket holding the first event of the queue
+        :returns: the index of the bucket and the time slot of the event, or
+        None if the queue is empty
+        """
+        buckets = self.buckets
+        count = len(buckets)
+        width = self.width
+        slot = self.slot
+        # look for an event in the current time slot, moving one slot at a
+        # time for a whole year
+        for _ in range(count):
+            i = slot % count
+            bucket = buckets[i]
+            if bucket and int(bucket[0][0] / width) == slot:
+                return i, slot
+            slot += 1
+        # no event within a year: find the minimum by looking at all buckets
+        first = None
+        for i in range(count):
+            bucket = buckets[i]
+            if bucket and (first is None or bucket[0] < buckets[first][0]):
+                first = i
+        if first is None:
+            return None
+        return first, int(buckets[first][0][0] / width)
+
+    def pop(self):
+        while self.size > 0:
+            i, slot = self.find()
+            t, _, event = self.buckets[i].pop(0)
+            self.size -= 1
+            if event.pending:
+                event.pending = False
+                # move forward in time only for pending events: the
+                # simulation time is not updated for canceled ones
+                self.slot = slot
+                self.last_time = t
+                if self.size < len(self.buckets) // 2 and \
+                   len(self.buckets) > self.MIN_BUCKETS:
+                    self.resize(len(self.buckets) // 2)
+                return event
+            self.canceled -= 1
+        return None
+
+    def peek(self):
+        while self.size > 0:
+            i, _ = self.find()
+            event = self.buckets[i][0][2]
+            if event.pending:
+                return event
+            # canceled events can be discarded without moving in time
+            self.buckets[i].pop(0)
+            self.size -= 1
+            self.canceled -= 1
+        return None
+
+    def compact(self):
+        self.canceled = 0
+        self.resize(len(self.buckets))
+
+    def entries(self):
+        return self.size
+
+    def resize(self, buckets):
+        """
+        Rebuilds the calendar with a new number of buckets, estimating the
+        bucket width from the spacing of the first events of the queue.
+        Canceled events are dropped in the process
+        :param buckets: the new number of buckets
+        """
+        entries = sorted(e for b in self.buckets for e in b if e[2].pending)
+        self.width = self.estimate_width(entries)
+        self.buckets = [[] for _ in range(max(buckets, self.MIN_BUCKETS))]
+        count = len(self.buckets)
+        # entries are already sorted, so appending keeps buckets sorted
+        for e in entries:
+            self.buckets[int(e[0] / self.width) % count].append(e)
+        self.size = len(entries)
+        self.canceled = 0
+        self.slot = int(self.last_time / self.width)
+
+    def estimate_width(self, entries):
+        """
+        Estimates a good bucket width, as three times the average separation
+        between the first events of the queue, ignoring separations much
+        larger than the average
+        :param entries: the sorted entries of the queue
+        :returns: the width of a bucket
+        """
+        times = [e[0] for e in entries[:self.WIDTH_SAMPLES]]
+        gaps = [b - a for a, b in zip(times, times[1:]) if b > a]
+        if len(gaps) == 0:
+            return self.width
+        average = sum(gaps) / len(gaps)
+        close = [g for g in gaps if g <= 2 * average]
+        if len(close) > 0:
+            average = sum(close) / len(close)
+        return 3 * average
+
+
+# available schedulers, by name
+SCHEDULERS = {
+    "heap": HeapScheduler,
+    "calendar": CalendarQueue,
+    "lanes": LaneScheduler,
+    "radix": RadixHeap,
+}
+
+
+def create_scheduler(name):
+    """
+    Instantiates a scheduler given its name
+    :param name: name of the scheduler, one of the keys of SCHEDULERS
+    :returns: the scheduler instance
+    """
+    if name not in SCHEDULERS:
+        raise ValueError("Scheduler %s not recognized. Use one of %s" %
+                         (name, ", ".join(sorted(SCHEDULERS.keys()))))
+    return SCHEDULERS[name]()
@@ -14,27 +14,43 @@
 # Copyright (C) 2016 Michele Segata <segata@ccs-labs.org>
 
 from __future__ import division, absolute_import
+import os
 import sys
-import heapq
 import random
+import pickle
+import traceback
 import time
 import math
+import gc
+import hashlib
+try:
+    import resource
+except ImportError:
+    # not available on Windows: peak memory is not reported
+    resource = None
 
-from log import Log
-from singleton import Singleton
+from log import Log, WeightedLog
 from config import Config
 from channel import Channel
 from node import Node
+from arrival import ArrivalSource
+from distribution import Distribution, Antithetic
+from scheduler import SCHEDULERS, create_scheduler
+from profiler import Profiler
+from event import Event
+from packet import Packet
 
 
 # VT100 command for erasing content of the current prompt line
 ERASE_LINE = '\x1b[2K'
 
 
-@Singleton
 class Sim:
     """
-    Main simu class
+    Main simu class. A simulation owns all of its state: clock, queue of
+    events, random number generator, data logger and id counters. Several
+    simulations can thus be created and run one after the other in the same
+    process
     """
 
     # name of the section in the configuration file that includes all simulation
@@ -50,6 +66,66 @@ class Sim:
     ALOHA = "aloha"
     TRIVIAL_CARRIER_SENSING = "trivial"
     SIMPLE_CARRIER_SENSING = "simple"
+    # scheduler parameter
+    PAR_SCHEDULER = "scheduler"
+    # scheduler used when not specified
+    DEFAULT_SCHEDULER = "heap"
+    # if true, the arrivals of all nodes are generated by a single Poisson
+    # process, when possible. optional, false if missing
+    PAR_SUPERPOSED_ARRIVALS = "superposed_arrivals"
+    # number of ticks per second of the integer time base. optional, if
+    # missing times are not quantized
+    PAR_TIME_RESOLUTION = "time_resolution"
+    # if true, every module draws each of its random variables from its own
+    # generator, seeded from the run seed. optional, false if missing
+    PAR_INDEPENDENT_STREAMS = "independent_streams"
+    # if true, the arrival and size streams of each module are independent
+    # of the rest, so that they are the same for all the protocols
+    # (common random numbers). optional, false if missing
+    PAR_COMMON_RANDOM_NUMBERS = "common_random_numbers"
+    # if true, the arrival and size streams return antithetic values. set it
+    # to [0, 1] to simulate antithetic pairs of runs. if present, even if
+    # false, implies common random numbers. optional
+    PAR_ANTITHETIC = "antithetic"
+    # importance sampling: factors multiplying the rate of the exponential
+    # interarrival times and of the exponential waiting time of Simple
+    # Carrier Sensing. log likelihood ratios are logged in an additional
+    # column. optional, 1 (no bias) if missing
+    PAR_ARRIVAL_BIAS = "arrival_bias"
+    PAR_BACKOFF_BIAS = "backoff_bias"
+    # streams shared across protocols with common random numbers
+    COMMON_STREAMS = [Node.STREAM_ARRIVAL, Node.STREAM_SIZE]
+    # maximum number of events to process, and maximum seconds of real time
+    # to run. optional, no limit if missing
+    PAR_MAX_EVENTS = "max_events"
+    PAR_MAX_WALL_TIME = "max_wall_time"
+    # reasons why run() returns
+    # the simulation reached its duration
+    STATUS_COMPLETED = "completed"
+    # no more events in the queue
+    STATUS_EMPTY = "empty"
+    # the maximum number of events has been processed
+    STATUS_EVENT_LIMIT = "event_limit"
+    # the maximum real time has elapsed
+    STATUS_TIME_LIMIT = "time_limit"
+    # progress reporting modes
+    PROGRESS_BAR = "bar"
+    PROGRESS_LINES = "lines"
+    PROGRESS_NONE = "none"
+    PROGRESS_MODES = [PROGRESS_BAR, PROGRESS_LINES, PROGRESS_NONE]
+    # seconds of real time between two progress reports
+    PROGRESS_PERIOD = 1
+    # approximate seconds of real time between two reads of the clock
+    PROGRESS_CHECK_PERIOD = 0.1
+    # number of events processed before reading the clock for the first time
+    PROGRESS_FIRST_CHECK = 1000
+    # garbage collector modes during the main loop: untouched, objects
+    # existing at the start frozen so that collections ignore them, or
+    # disabled
+    GC_DEFAULT = "default"
+    GC_FREEZE = "freeze"
+    GC_DISABLE = "disable"
+    GC_MODES = [GC_DEFAULT, GC_FREEZE, GC_DISABLE]
 
     def __init__(self):
         """
@@ -58,10 +134,14 @@ class Sim:
         """
         # current simulation time
         self.time = 0
-        # queue of events, implemented as a heap
-        self.queue = []
+        # queue of events. the default scheduler is replaced in initialize()
+        # by the one selected by the user
+        self.queue = create_scheduler(self.DEFAULT_SCHEDULER)
         # list of nodes
         self.nodes = []
+        # module generating the arrivals of all nodes, None if each node
+        # generates its own
+        self.arrival_source = None
         # initialize() should be called before running the simulation
         self.initialized = False
         # empty config file
@@ -73,8 +153,60 @@ class Sim:
         # reception model
         self.use_realistic_propagation = False
         self.persistence = None
+        # scheduler name. if None, the one in the config file is used
+        self.scheduler = None
+        # ticks per second of the integer time base. if None, the one in the
+        # config file is used, if any
+        self.time_resolution = None
+        # how to report the progress of the simulation
+        self.progress = self.PROGRESS_BAR
+        # folder where the output file is written
+        self.output_folder = ""
+        # file where the state of the simulation is saved. None disables
+        # checkpointing
+        self.checkpoint_file = None
+        # simulated time between two checkpoints. None to only save the state
+        # on demand
+        self.checkpoint_interval = None
+        # simulated time of the next periodic checkpoint
+        self.next_checkpoint = float("inf")
+        # set to True to save the state as soon as possible
+        self.checkpoint_requested = False
+        # True while simulating the prefix shared by several variants
+        self.shared_prefix = False
+        # limits on the number of processed events and on the real time
+        # of run(). None means no limit
+        self.max_events = None
+        self.max_wall_time = None
+        # free list of processed events, reused instead of allocating new
+        # objects
+        self.event_pool = []
+        # what to do with the garbage collector during the main loop
+        self.gc_mode = self.GC_DEFAULT
+        # statistics about the execution of the simulation. None disables
+        # profiling
+        self.profiler = None
+        # number of events processed so far
+        self.events = 0
+        # random number generator, seeded in initialize()
+        self.rng = random.Random()
+        # importance sampling biases, and log likelihood ratio of all the
+        # values drawn so far with respect to the nominal distributions
+        self.arrival_bias = 1
+        self.backoff_bias = 1
+        self.log_weight = 0.0
+        # whether modules get their own random number generators, for all the
+        # streams or only for the common ones, and whether the common ones are
+        # antithetic
+        self.independent_streams = False
+        self.common_random_numbers = False
+        self.antithetic = False
+        # counters used to assign unique ids to modules, packets and events
+        self.modules_count = 0
+        self.packets_count = 0
+        self.events_count = 0
 
-    def set_config(self, config_file, section, protocol, use_realistic_propagation, persistence):
+    def set_config(self, config_file, section, protocol, use_realistic_propagation, persistence, scheduler=None):
         """
         Set config file and section
         :param config_file: file name of the config file
@@ -82,6 +214,8 @@ class Sim:
         :param protocol: sending protocol. Either "aloha" or "trivial"
         :param use_realistic_propagation: set to True to use a realistic reception model, False to use the standard
         :param persistence: persistence probability, to use only in case of Simple Carrier Sensing
+        :param scheduler: name of the scheduler to use. If None, the scheduler is taken from the config file, or the
+        binary heap is used if not specified there either
         """
         self.config_file = config_file
         self.section = section
@@ -90,6 +224,10 @@ class Sim:
             raise ValueError("Protocol %s not recognized. Use either '%s', %s or '%s'" %
                              (protocol, self.ALOHA, self.TRIVIAL_CARRIER_SENSING, self.SIMPLE_CARRIER_SENSING))
         self.protocol = protocol
+        if scheduler is not None and scheduler not in SCHEDULERS:
+            raise ValueError("Scheduler %s not recognized. Use one of %s" %
+                             (scheduler, ", ".join(sorted(SCHEDULERS.keys()))))
+        self.scheduler = scheduler
         # instantiate config manager
         self.config = Config(self.config_file, self.section)
         # set reception model
@@ -130,34 +268,197 @@ class Sim:
                   "runs" % run_number)
             sys.exit(1)
         self.config.set_run_number(run_number)
-        # instantiate data logger
-        self.logger = Log(self.config.get_output_file())
+        # instantiate data logger. with importance sampling, events are
+        # logged together with their weight
+        self.arrival_bias = self.config.get_optional_param(self.PAR_ARRIVAL_BIAS, 1)
+        self.backoff_bias = self.config.get_optional_param(self.PAR_BACKOFF_BIAS, 1)
+        if self.arrival_bias <= 0 or self.backoff_bias <= 0:
+            print("Error, importance sampling biases must be positive")
+            sys.exit(1)
+        if self.arrival_bias != 1 and \
+                ArrivalSource.get_rate(Distribution(self.config.get_param(Node.INTERARRIVAL))) is None:
+            print("Error, importance sampling can only bias exponential interarrival times")
+            sys.exit(1)
+        if self.arrival_bias != 1 or self.backoff_bias != 1:
+            self.logger = WeightedLog(self, os.path.join(self.output_folder, self.config.get_output_file()))
+        else:
+            self.logger = Log(self, os.path.join(self.output_folder, self.config.get_output_file()))
         # get simulation duration
         self.duration = self.config.get_param(self.PAR_DURATION)
         # get seeds. each seed generates a simulation repetition
         self.seed = self.config.get_param(self.PAR_SEED)
-        random.seed(self.seed)
+        self.rng.seed(self.seed)
+        self.independent_streams = self.config.get_optional_param(self.PAR_INDEPENDENT_STREAMS, False)
+        # both runs of an antithetic pair, including the one with antithetic
+        # set to 0, use common random numbers, so that their streams mirror
+        # each other
+        antithetic = self.config.get_optional_param(self.PAR_ANTITHETIC, None)
+        self.antithetic = bool(antithetic)
+        self.common_random_numbers = antithetic is not None or \
+            self.config.get_optional_param(self.PAR_COMMON_RANDOM_NUMBERS, False)
+        # instantiate the scheduler. the command line has priority over the
+        # config file
+        scheduler = self.scheduler
+        if scheduler is None:
+            scheduler = self.config.get_optional_param(self.PAR_SCHEDULER, self.DEFAULT_SCHEDULER)
+        self.queue = create_scheduler(scheduler)
+        # use an integer time base if requested
+        if self.time_resolution is None:
+            self.time_resolution = self.config.get_optional_param(self.PAR_TIME_RESOLUTION, None)
+        if self.time_resolution is not None:
+            self.queue.set_resolution(self.time_resolution)
+        # limits set by the user have priority over the config file
+        if self.max_events is None:
+            self.max_events = self.config.get_optional_param(self.PAR_MAX_EVENTS, None)
+        if self.max_wall_time is None:
+            self.max_wall_time = self.config.get_optional_param(self.PAR_MAX_WALL_TIME, None)
         # instantiate the channel
-        self.channel = Channel(self.config, self.use_realistic_propagation)
+        self.channel = Channel(self, self.config, self.use_realistic_propagation)
+        # superpose the arrivals of all nodes if requested. this is only
+        # possible with exponential interarrival times
+        rate = None
+        if self.config.get_optional_param(self.PAR_SUPERPOSED_ARRIVALS, False):
+            rate = ArrivalSource.get_rate(Distribution(self.config.get_param(Node.INTERARRIVAL)))
+            if rate is None:
+                print("Interarrival times are not exponential: arrivals cannot be superposed. "
+                      "Each node generates its own arrivals")
         # instantiate all the nodes
         positions = self.config.get_param(self.PAR_NODES)
-        for p in positions:
+        for i, p in enumerate(positions):
             x = p[0]
             y = p[1]
-            node = Node(self.config, self.channel, x, y, self.protocol, self.persistence)
-            # let the channel know about this node
-            self.channel.register_node(node)
+            self.nodes.append(Node(self, self.config, self.channel, x, y, self.protocol, self.persistence,
+                                   rate is None, i))
+        # let the channel know about the nodes, computing the topology once
+        self.channel.register_nodes(self.nodes)
+        for node in self.nodes:
             node.initialize()
-            self.nodes.append(node)
+        # the source is created after the nodes, so that node ids do not change
+        if rate is not None:
+            self.arrival_source = ArrivalSource(self, self.nodes, rate)
+            self.arrival_source.initialize()
+        if self.profiler is not None:
+            self.profiler.install(self)
         # all done. simulation can start now
         self.initialized = True
 
+    def get_rng(self, module, purpose):
+        """
+        Returns the random number generator a module should use for a
+        purpose. With independent streams, each (module, purpose) pair gets
+        its own generator, whose seed is derived by hashing the run seed, the
+        id of the module and the purpose. Streams thus do not depend on each
+        other, nor on the order of the draws: adding a module or a draw only
+        changes the streams involved. With common random numbers, only the
+        COMMON_STREAMS are independent, so that they are the same for all
+        the protocols, and possibly antithetic. Otherwise, all modules share
+        the generator of the simulation
+        :param module: the module drawing the values
+        :param purpose: name of the random variable, e.g., "arrival"
+        :returns: an instance of random.Random
+        """
+        common = purpose in self.COMMON_STREAMS
+        if not self.independent_streams and not (self.common_random_numbers and common):
+            return self.rng
+        seed = self.spawn_seed(module.get_id(), purpose)
+        if self.antithetic and common:
+            return Antithetic(seed)
+        return random.Random(seed)
+
+    def spawn_seed(self, *keys):
+        """
+        Derives a seed from the run seed and a list of keys. The derivation
+        uses SHA-256 rather than hash(), so that seeds do not change across
+        processes and Python versions
+        :param keys: values identifying the stream
+        :returns: a 128 bit integer seed
+        """
+        key = "/".join(str(k) for k in (self.seed,) + keys)
+        return int.from_bytes(hashlib.sha256(key.encode("utf-8")).digest()[:16], "big")
+
+    def set_persistence(self, persistence):
+        """
+        Changes the persistence probability of all nodes
+        :param persistence: the new persistence probability
+        """
+        if self.protocol != self.SIMPLE_CARRIER_SENSING:
+            raise ValueError("The persistence can only be set with Simple Carrier Sensing")
+        if not (0.0 <= persistence <= 1.0):
+            raise ValueError("The persistence must be between 0 and 1. %f given" % persistence)
+        self.persistence = persistence
+        for node in self.nodes:
+            node.persistence = persistence
+
+    def get_modules(self):
+        """
+        Returns all the modules of the simulation
+        """
+        modules = [self.channel] + self.nodes
+        if self.arrival_source is not None:
+            modules.append(self.arrival_source)
+        return modules
+
     def get_logger(self):
         """
         Returns the data logger to modules
         """
         return self.logger
 
+    def next_module_id(self):
+        """
+        Returns a new module id, unique within the simulation
+        """
+        module_id = self.modules_count
+        self.modules_count += 1
+        return module_id
+
+    def next_packet_id(self):
+        """
+        Returns a new packet id, unique within the simulation
+        """
+        packet_id = self.packets_count
+        self.packets_count += 1
+        return packet_id
+
+    def add_fixed_delay(self, event_type):
+        """
+        Declares that events of a type are always scheduled with the same delay
+        after the current time, letting the scheduler store them more
+        efficiently
+        :param event_type: the type of event
+        """
+        self.queue.add_lane(event_type)
+
+    def new_event(self, event_time, event_type, destination, source, obj=None):
+        """
+        Returns an event, reusing a processed one if available. Events are
+        recycled as soon as their handler returns, so modules must not keep
+        references to events they have already handled
+        :param event_time: time at which the event should be scheduled
+        :param event_type: type of event
+        :param destination: destination module that should be notified
+        :param source: module generating the event
+        :param obj: optional object to be attached to the event
+        """
+        if self.event_pool:
+            event = self.event_pool.pop()
+            event.event_time = event_time
+            event.event_type = event_type
+            event.destination = destination
+            event.source = source
+            event.obj = obj
+            return event
+        return Event(event_time, event_type, destination, source, obj)
+
+    def new_packet(self, size, duration):
+        """
+        Returns a packet with a new id. Packets are not reused, as receptions
+        keep referring to them after the end of the transmission
+        :param size: size of the packet in bytes
+        :param duration: packet duration in seconds
+        """
+        return Packet(size, duration, self.next_packet_id())
+
     def get_time(self):
         """
         Returns current simulation time
@@ -177,35 +478,287 @@ class Sim:
                                 self.time,
                                 event.get_time()))
             sys.exit(1)
-        heapq.heappush(self.queue, event)
+        # with an integer time base, events happen at an integer number of
+        # ticks. simultaneous events are thus exactly simultaneous, and ordered
+        # by id
+        if self.time_resolution is not None:
+            event.event_time = round(event.event_time * self.time_resolution) / self.time_resolution
+        # number events in scheduling order. this makes ids, and thus the
+        # ordering of simultaneous events, independent of other simulations
+        # run in the same process
+        event.event_id = self.events_count
+        self.events_count += 1
+        self.queue.schedule(event)
 
     def next_event(self):
         """
         Returns the first event in the queue
+        :returns: the event, or None if the queue is empty
         """
-        try:
-            event = heapq.heappop(self.queue)
-            self.time = event.event_time
-            return event
-        except IndexError:
-            print("No more events in the simulation queue. Terminating.")
-            sys.exit(0)
+        event = self.queue.pop()
+        if event is None:
+            return None
+        self.time = event.event_time
+        return event
 
     def cancel_event(self, event):
         """
-        Deletes a scheduled event from the queue
+        Deletes a scheduled event from the queue. The event is only marked as
+        canceled and discarded when it reaches the top of the queue
         :param event: the event to be canceled
         """
-        try:
-            self.queue.remove(event)
-            heapq.heapify(self.queue)
-        except ValueError:
+        if not event.pending:
             print("Trying to delete an event that does not exist.")
             sys.exit(1)
+        self.queue.cancel(event)
+
+    def set_output_folder(self, output_folder):
+        """
+        Sets the folder where the output file is written. By default, it is
+        written in the current folder
+        :param output_folder: the output folder, which must exist
+        """
+        self.output_folder = output_folder
+
+    def set_checkpoint(self, checkpoint_file, checkpoint_interval=None):
+        """
+        Enables checkpointing: the whole state of the simulation is saved to
+        a file, from which it can be restored with restore() and continued,
+        producing the same output as an uninterrupted run. The state is saved
+        on demand, calling request_checkpoint(), and optionally periodically
+        :param checkpoint_file: file the state is saved to. It is overwritten
+        at every checkpoint
+        :param checkpoint_interval: simulated time in seconds between two
+        checkpoints, or None to only save the state on demand
+        """
+        self.checkpoint_file = checkpoint_file
+        self.checkpoint_interval = checkpoint_interval
+        if checkpoint_interval is None:
+            self.next_checkpoint = float("inf")
+        else:
+            self.next_checkpoint = self.time + checkpoint_interval
+
+    def request_checkpoint(self):
+        """
+        Asks the simulation to save its state as soon as possible. This only
+        sets a flag, so it is safe to call it from a signal handler
+        """
+        self.checkpoint_requested = True
+
+    def checkpoint(self):
+        """
+        Saves the state of the simulation to the checkpoint file. The output
+        file is flushed and its current size is saved with the state, so that
+        restoring discards whatever is written after the checkpoint
+        """
+        self.checkpoint_requested = False
+        while self.next_checkpoint <= self.time:
+            self.next_checkpoint += self.checkpoint_interval
+        # write to a temporary file first, so that a previous checkpoint is
+        # not lost if the process is killed while saving
+        tmp_file = self.checkpoint_file + ".tmp"
+        with open(tmp_file, "wb") as f:
+            pickle.dump(self, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, self.checkpoint_file)
+
+    @staticmethod
+    def restore(checkpoint_file):
+        """
+        Restores a simulation from a checkpoint file. Calling run() on the
+        returned instance continues the simulation from the checkpoint. The
+        output file is truncated to its size at the time of the checkpoint
+        :param checkpoint_file: the checkpoint file
+        :returns: the restored simulation
+        """
+        with open(checkpoint_file, "rb") as f:
+            return pickle.load(f)
+
+    def set_progress(self, progress):
+        """
+        Sets how the progress of the simulation is reported
+        :param progress: either PROGRESS_BAR (progress bar on the terminal),
+        PROGRESS_LINES (one line of text with sim time, events per second and
+        ETA at every update, for batch runs) or PROGRESS_NONE (nothing)
+        """
+        if progress not in self.PROGRESS_MODES:
+            raise ValueError("Progress mode %s not recognized. Use one of %s" %
+                             (progress, ", ".join(self.PROGRESS_MODES)))
+        self.progress = progress
+
+    def set_time_resolution(self, time_resolution):
+        """
+        Makes the simulation use an integer time base: event times are rounded
+        to the closest multiple of 1 / time_resolution seconds when scheduled.
+        Overrides the resolution set in the config file. Must be called before
+        initialize()
+        :param time_resolution: number of ticks per second, e.g., 1e9 for
+        nanoseconds
+        """
+        if time_resolution <= 0:
+            raise ValueError("The time resolution must be positive. %f given" % time_resolution)
+        self.time_resolution = time_resolution
+
+    def set_limits(self, max_events=None, max_wall_time=None):
+        """
+        Sets additional termination conditions, overriding the ones in the
+        config file. run() returns as soon as one of them is met, even if the
+        simulation has not reached its duration
+        :param max_events: maximum number of events processed by the
+        simulation, including the ones processed before a checkpoint. None
+        leaves the current limit unchanged
+        :param max_wall_time: maximum seconds of real time spent by each call
+        to run(). None leaves the current limit unchanged
+        """
+        if max_events is not None:
+            self.max_events = max_events
+        if max_wall_time is not None:
+            self.max_wall_time = max_wall_time
+
+    def set_gc_mode(self, gc_mode):
+        """
+        Sets what to do with the cyclic garbage collector while running. The
+        simulation creates no reference cycles while running, so the
+        collector only wastes time scanning long lived objects. GC_FREEZE
+        moves all existing objects to a permanent generation ignored by
+        collections, GC_DISABLE disables the collector until the end of
+        run()
+        :param gc_mode: one of GC_DEFAULT, GC_FREEZE or GC_DISABLE
+        """
+        if gc_mode not in self.GC_MODES:
+            raise ValueError("Garbage collector mode %s not recognized. Use one of %s" %
+                             (gc_mode, ", ".join(self.GC_MODES)))
+        self.gc_mode = gc_mode
+
+    def set_profiling(self, enabled):
+        """
+        Enables the collection of statistics about the execution of the
+        simulation: events per type, wall time of event handlers, channel and
+        logging, and size of the queue of events. A summary is printed at the
+        end of the simulation. Must be called before initialize(). When
+        disabled, profiling costs nothing
+        :param enabled: True to enable profiling
+        """
+        if self.initialized:
+            raise ValueError("Profiling must be enabled before initializing the simulation")
+        self.profiler = Profiler() if enabled else None
+
+    def process_next_event(self):
+        """
+        Processes the first event of the queue
+        :returns: False if the queue is empty, True otherwise
+        """
+        event = self.queue.pop()
+        if event is None:
+            return False
+        self.time = event.event_time
+        event.destination.handle_event(event)
+        self.events += 1
+        return True
+
+    def simulate_shared_prefix(self):
+        """
+        Simulates the part of the simulation that does not depend on the
+        persistence, i.e., until a node is about to use the persistence for
+        the first time. Nodes tell in advance whether an event makes them use
+        it, so the simulation stops right before that event, and no snapshot
+        is needed to roll it back
+        :returns: this simulation, stopped right before the first event using
+        the persistence
+        """
+        self.shared_prefix = True
+        while self.time <= self.duration:
+            event = self.queue.peek()
+            if event is None or (isinstance(event.destination, Node) and event.destination.uses_persistence(event)):
+                break
+            self.process_next_event()
+        self.shared_prefix = False
+        return self
+
+    def run_variants(self, variants, use_fork=None):
+        """
+        Runs several variants of this simulation differing only in the
+        persistence. The part of the simulation they have in common is
+        simulated only once, then each variant is continued from there,
+        either in a forked process (copy-on-write, variants run in parallel)
+        or from an in-memory snapshot (variants run one after the other). The
+        output of each variant is the same as the one of a separate run.
+        Must be called after initialize(), instead of run()
+        :param variants: list of (output_folder, persistence) pairs. The output
+        file of each variant is written in its output folder
+        :param use_fork: True to fork a process per variant, False to restore
+        snapshots, None to fork if the platform supports it
+        :returns: the list of variants that failed, when forking. Without
+        forking, errors are raised as usual
+        """
+        if not self.initialized:
+            print("Cannot run the simulation. Call initialize() first")
+            sys.exit(1)
+        if use_fork is None:
+            use_fork = hasattr(os, "fork")
+        output_file = self.config.get_output_file()
+        # log the shared prefix in a temporary file, copied by every variant
+        prefix_file = self.logger.output_file + ".prefix"
+        self.logger.redirect(prefix_file, keep=False)
+        prefix = self.simulate_shared_prefix()
+        failures = []
+        if use_fork:
+            prefix.logger.log_file.flush()
+            sys.stdout.flush()
+            children = {}
+            for folder, persistence in variants:
+                pid = os.fork()
+                if pid == 0:
+                    # child process: continue the simulation with its own
+                    # persistence and output file
+                    code = 0
+                    try:
+                        prefix.prepare_variant(folder, output_file, persistence)
+                        prefix.run()
+                    except SystemExit as e:
+                        code = 0 if e.code in (None, 0) else 1
+                    except BaseException:
+                        traceback.print_exc()
+                        code = 1
+                    sys.stdout.flush()
+                    os._exit(code)
+                children[pid] = (folder, persistence)
+            for pid in children:
+                _, status = os.waitpid(pid, 0)
+                if status != 0:
+                    failures.append(children[pid])
+        else:
+            snapshot = pickle.dumps(prefix, pickle.HIGHEST_PROTOCOL)
+            for folder, persistence in variants:
+                variant = pickle.loads(snapshot)
+                variant.prepare_variant(folder, output_file, persistence)
+                variant.run()
+        prefix.logger.close()
+        os.remove(prefix_file)
+        return failures
+
+    def prepare_variant(self, folder, output_file, persistence):
+        """
+        Prepares the continuation of the shared prefix as a variant: the
+        output and, if checkpointing is enabled, the checkpoint are written
+        in the folder of the variant, so that variants do not overwrite the
+        files of each other
+        :param folder: output folder of the variant
+        :param output_file: name of the output file
+        :param persistence: persistence of the variant
+        """
+        self.logger.redirect(os.path.join(folder, output_file))
+        self.set_persistence(persistence)
+        if self.checkpoint_file is not None:
+            self.checkpoint_file = os.path.join(folder, os.path.basename(self.checkpoint_file))
 
     def run(self):
         """
-        Runs the simulation.
+        Runs the simulation, until it reaches its duration or one of the
+        limits set with set_limits() is met. When stopped by a limit, the
+        output file contains the events logged so far and, if checkpointing
+        is enabled, the state is saved so that the simulation can be continued
+        :returns: the reason why the simulation stopped, one of the STATUS_*
+        constants
         """
         # first check that everything is ready
         if not self.initialized:
@@ -213,31 +766,162 @@ class Sim:
             sys.exit(1)
         # save the time at which the simulation started, for statistical purpose
         start_time = time.time()
-        # last time we printed the simulation percentage
+        # last time we reported the progress
         prev_time = start_time
-        # print percentage for the first time (0%)
-        self.print_percentage(True)
-        # main simulation loop
-        while self.time <= self.duration:
-            # get next event and call the handle method of the destination
-            event = self.next_event()
-            dst = event.get_destination()
-            dst.handle_event(event)
-            # get current real time
-            curr_time = time.time()
-            # if more than a second has elapsed, update the percentage bar
-            if curr_time - prev_time >= 1:
-                self.print_percentage(False)
-                prev_time = curr_time
-        # simulation completed, print the percentage for the last time (100%)
-        self.print_percentage(False)
+        # simulation time at the last report
+        prev_sim_time = self.time
+        # events processed at the last report
+        prev_events = self.events
+        start_events = self.events
+        # termination conditions other than the duration
+        max_events = sys.maxsize if self.max_events is None else self.max_events
+        deadline = float("inf") if self.max_wall_time is None else start_time + self.max_wall_time
+        status = self.STATUS_COMPLETED
+        # reading the clock after every event is expensive: the clock is read
+        # every check_every events, adapting the interval to the event rate so
+        # that the clock is read about every PROGRESS_CHECK_PERIOD seconds. if
+        # progress is not reported, checkpointing is disabled and there is no
+        # wall time limit, the clock is never read
+        if self.progress == self.PROGRESS_NONE and self.checkpoint_file is None and \
+           self.max_wall_time is None:
+            check_every = sys.maxsize
+        else:
+            check_every = self.PROGRESS_FIRST_CHECK
+        # never go past the maximum number of events
+        check_every = max(1, min(check_every, max_events - self.events))
+        countdown = check_every
+        # last time the clock was read
+        check_time = start_time
+        # report progress for the first time (0%)
+        self.report_progress(True, 0, 0)
+        gc_enabled = gc.isenabled()
+        if self.gc_mode == self.GC_FREEZE:
+            gc.collect()
+            gc.freeze()
+        elif self.gc_mode == self.GC_DISABLE:
+            gc.disable()
+        # main simulation loop. next_event() is inlined to save a function
+        # call per event
+        pop = self.queue.pop
+        # processed events are recycled
+        recycle = self.event_pool.append
+        # simulation time up to which events are processed
+        until = self.duration
+        if self.events >= max_events:
+            # nothing left to do, e.g., when continuing from a checkpoint
+            status = self.STATUS_EVENT_LIMIT
+            until = -1
+        while self.time <= until:
+            # get next event and call the handler registered by the destination
+            event = pop()
+            if event is None:
+                status = self.STATUS_EMPTY
+                break
+            self.time = event.event_time
+            handler = event.destination.handlers.get(event.event_type)
+            if handler is None:
+                # let the module report the error
+                event.destination.handle_event(event)
+            else:
+                handler(event)
+            recycle(event)
+            countdown -= 1
+            if countdown == 0:
+                self.events += check_every
+                # get current real time
+                curr_time = time.time()
+                # save the state if it is time to do it
+                if self.checkpoint_file is not None and \
+                   (self.time >= self.next_checkpoint or self.checkpoint_requested):
+                    self.checkpoint()
+                # adapt the check interval to the current event rate, at most
+                # doubling it at each check
+                if curr_time > check_time:
+                    rate = check_every / (curr_time - check_time)
+                    check_every = max(1, min(2 * check_every,
+                                             int(rate * self.PROGRESS_CHECK_PERIOD)))
+                else:
+                    check_every *= 2
+                check_time = curr_time
+                check_every = max(1, min(check_every, max_events - self.events))
+                countdown = check_every
+                # if more than a second has elapsed, report the progress
+                elapsed = curr_time - prev_time
+                if elapsed >= self.PROGRESS_PERIOD:
+                    self.report_progress(False,
+                                         (self.events - prev_events) / elapsed,
+                                         (self.time - prev_sim_time) / elapsed)
+                    prev_time = curr_time
+                    prev_sim_time = self.time
+                    prev_events = self.events
+                # stop if a limit has been reached
+                if self.events >= max_events:
+                    status = self.STATUS_EVENT_LIMIT
+                    break
+                if curr_time >= deadline:
+                    status = self.STATUS_TIME_LIMIT
+                    break
+        self.events += check_every - countdown
         # compute how much time the simulation took
         end_time = time.time()
+        if self.gc_mode == self.GC_FREEZE:
+            gc.unfreeze()
+        elif gc_enabled:
+            gc.enable()
+        # simulation completed, report the progress for the last time (100%)
+        if end_time > prev_time:
+            self.report_progress(False,
+                                 (self.events - prev_events) / (end_time - prev_time),
+                                 (self.time - prev_sim_time) / (end_time - prev_time))
+        else:
+            self.report_progress(False, 0, 0)
+        if self.progress == self.PROGRESS_BAR:
+            sys.stdout.write("\n")
+        # save the state of a simulation stopped by a limit, so that it can
+        # be continued later
+        if self.checkpoint_file is not None and \
+           status in (self.STATUS_EVENT_LIMIT, self.STATUS_TIME_LIMIT):
+            self.checkpoint()
+        for module in self.get_modules():
+            module.finalize()
+        self.logger.close()
         total_time = round(end_time - start_time)
-        print("\nMaximum simulation time reached. Terminating.")
+        if status == self.STATUS_COMPLETED:
+            print("Maximum simulation time reached. Terminating.")
+        elif status == self.STATUS_EMPTY:
+            print("No more events in the simulation queue. Terminating.")
+        elif status == self.STATUS_EVENT_LIMIT:
+            print("Maximum number of events reached after %d events at time %f. Terminating." %
+                  (self.events, self.time))
+        else:
+            print("Maximum wall time reached after %d events at time %f. Terminating." %
+                  (self.events, self.time))
         print("Total simulation time: %d hours, %d minutes, %d seconds" %
               (total_time // 3600, total_time % 3600 // 60,
                total_time % 3600 % 60))
+        if end_time > start_time:
+            print("Processed %d events, %.0f events per second" %
+                  (self.events - start_events, (self.events - start_events) / (end_time - start_time)))
+        if resource is not None:
+            # kilobytes on Linux, bytes on macOS
+            scale = 1 if sys.platform == "darwin" else 1024
+            print("Peak memory usage: %.1f MB" %
+                  (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 1024 / 1024))
+        if self.profiler is not None:
+            print(self.profiler.summary(end_time - start_time))
+        return status
+
+    def report_progress(self, first, event_rate, time_rate):
+        """
+        Reports the progress of the simulation, depending on the progress mode
+        :param first: True if this is the first report
+        :param event_rate: events processed per second of real time
+        :param time_rate: seconds of simulated time per second of real time
+        """
+        if self.progress == self.PROGRESS_BAR:
+            self.print_percentage(first)
+        elif self.progress == self.PROGRESS_LINES:
+            self.print_progress_line(event_rate, time_rate)
 
     def print_percentage(self, first):
         # go back to the beginning of the line
@@ -250,6 +934,24 @@ class Sim:
                          ('='*(perc//5), perc, self.time, self.duration))
         sys.stdout.flush()
 
+    def print_progress_line(self, event_rate, time_rate):
+        """
+        Prints the progress as a single line of key=value pairs, easy to parse
+        when collecting the output of many simulations
+        :param event_rate: events processed per second of real time
+        :param time_rate: seconds of simulated time per second of real time
+        """
+        remaining = max(0.0, self.duration - self.time)
+        if time_rate > 0:
+            eta = "%.1f" % (remaining / time_rate)
+        else:
+            eta = "nan"
+        sys.stdout.write("progress run=%d time=%f duration=%f events=%d "
+                         "events_per_sec=%.0f eta=%s\n" %
+                         (self.run_number, min(self.time, self.duration),
+                          self.duration, self.events, event_rate, eta))
+        sys.stdout.flush()
+
     def get_params(self, run_number):
         """
         Returns a textual representation of simulation parameters for a given
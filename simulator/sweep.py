@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import
+from optparse import OptionParser
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import contextlib
+import io
+import os
+import sys
+import time
+import traceback
+
+import sim
+from config import Config
+
+
+class Setting:
+    """
+    A protocol and propagation setting of the sweep. All the runs of a setting
+    are written in the same sub folder of the output folder
+    """
+
+    def __init__(self, folder, protocol, persistence, use_realistic_propagation):
+        """
+        Constructor.
+        :param folder: name of the sub folder where the output files are written
+        :param protocol: sending protocol, either aloha, trivial or simple
+        :param persistence: persistence probability for simple carrier sensing,
+        None for the other protocols
+        :param use_realistic_propagation: True to use the realistic propagation
+        """
+        self.folder = folder
+        self.protocol = protocol
+        self.persistence = persistence
+        self.use_realistic_propagation = use_realistic_propagation
+
+
+# settings simulated by a sweep, with the folder names expected by the
+# AnalysisManager
+SETTINGS = [
+    Setting("aloha_disk", sim.Sim.ALOHA, None, False),
+    Setting("aloha_prob", sim.Sim.ALOHA, None, True),
+    Setting("trivial_disk", sim.Sim.TRIVIAL_CARRIER_SENSING, None, False),
+    Setting("trivial_prob", sim.Sim.TRIVIAL_CARRIER_SENSING, None, True),
+    Setting("simple_disk_00", sim.Sim.SIMPLE_CARRIER_SENSING, 0.0, False),
+    Setting("simple_prob_75", sim.Sim.SIMPLE_CARRIER_SENSING, 0.75, True),
+    Setting("simple_prob_50", sim.Sim.SIMPLE_CARRIER_SENSING, 0.5, True),
+    Setting("simple_prob_25", sim.Sim.SIMPLE_CARRIER_SENSING, 0.25, True),
+    Setting("simple_prob_00", sim.Sim.SIMPLE_CARRIER_SENSING, 0.0, True),
+]
+
+
+class Job:
+    """
+    A single simulation of the sweep: one run of the config file simulated
+    with one setting, or with several settings differing only in the
+    persistence, sharing the common part of the simulation
+    """
+
+    def __init__(self, config_file, section, settings, run, output_folder, scheduler, max_wall_time=None):
+        """
+        Constructor.
+        :param config_file: file name of the config file
+        :param section: the section within the config file
+        :param settings: the list of Settings to simulate
+        :param run: the run number
+        :param output_folder: base output folder. The output file is written in
+        the sub folder of the setting
+        :param scheduler: name of the scheduler, or None to use the config file
+        :param max_wall_time: maximum seconds of real time of the simulation,
+        or None to use the config file
+        """
+        self.config_file = config_file
+        self.section = section
+        self.settings = settings
+        self.run = run
+        self.output_folder = output_folder
+        self.scheduler = scheduler
+        self.max_wall_time = max_wall_time
+
+    def get_folders(self):
+        """
+        Returns the folders where the output of the job is written, one per
+        setting
+        """
+        return [os.path.join(self.output_folder, s.folder) for s in self.settings]
+
+    def __str__(self):
+        return "%s run %d" % ("+".join(s.folder for s in self.settings), self.run)
+
+
+def group_settings(settings, share_prefix):
+    """
+    Groups the settings simulated by the same job
+    :param settings: list of settings to simulate
+    :param share_prefix: if True, Simple Carrier Sensing settings differing
+    only in the persistence are grouped together, so that the part of the
+    simulation they have in common is simulated only once
+    :returns: a list of lists of settings
+    """
+    groups = []
+    for s in settings:
+        group = None
+        if share_prefix and s.protocol == sim.Sim.SIMPLE_CARRIER_SENSING:
+            group = next((g for g in groups if g[0].protocol == s.protocol and
+                          g[0].use_realistic_propagation == s.use_realistic_propagation), None)
+        if group is None:
+            groups.append([s])
+        else:
+            group.append(s)
+    return groups
+
+
+def expand_jobs(config_file, section, settings, output_folder, scheduler=None, share_prefix=False,
+                max_wall_time=None):
+    """
+    Lists all the simulations of a sweep: every run of the config file for
+    every setting
+    :param config_file: file name of the config file
+    :param section: the section within the config file
+    :param settings: list of settings to simulate
+    :param output_folder: base output folder
+    :param scheduler: name of the scheduler, or None to use the config file
+    :param share_prefix: if True, settings differing only in the persistence
+    are simulated by the same job, sharing the common part of the simulation
+    :param max_wall_time: maximum seconds of real time of each simulation, or
+    None to use the config file
+    :returns: the list of jobs
+    """
+    runs_count = Config(config_file, section).get_runs_count()
+    return [Job(config_file, section, g, r, output_folder, scheduler, max_wall_time)
+            for g in group_settings(settings, share_prefix) for r in range(runs_count)]
+
+
+def run_job(job):
+    """
+    Runs a single job. This is executed by the worker processes. Anything the
+    simulation prints is captured, and returned in case of failure
+    :param job: the job to run
+    :returns: a tuple (job, error, duration, status), where error is None in
+    case of success, or a textual description of the failure, and status is
+    the reason why the simulation stopped, None for jobs running several
+    variants
+    """
+    start = time.time()
+    output = io.StringIO()
+    error = None
+    status = None
+    try:
+        with contextlib.redirect_stdout(output):
+            simulator = sim.Sim()
+            setting = job.settings[0]
+            folders = job.get_folders()
+            simulator.set_config(job.config_file, job.section, setting.protocol,
+                                 setting.use_realistic_propagation,
+                                 setting.persistence, job.scheduler)
+            simulator.set_progress(sim.Sim.PROGRESS_NONE)
+            simulator.set_output_folder(folders[0])
+            simulator.set_limits(max_wall_time=job.max_wall_time)
+            simulator.initialize(job.run)
+            if len(job.settings) == 1:
+                status = simulator.run()
+            else:
+                # worker processes already use all the cores: run the
+                # variants one after the other instead of forking
+                simulator.run_variants([(f, s.persistence) for f, s in zip(folders, job.settings)],
+                                       use_fork=False)
+    except SystemExit as e:
+        # the simulator terminates with sys.exit() on errors, after printing
+        # the reason
+        if e.code not in (None, 0):
+            error = output.getvalue().strip() or "exit code %s" % str(e.code)
+    except Exception:
+        error = traceback.format_exc().strip()
+    return job, error, time.time() - start, status
+
+
+def run_sweep(jobs, workers):
+    """
+    Runs all the jobs on a pool of processes, reporting the progress of the
+    sweep
+    :param jobs: the list of jobs to run
+    :param workers: number of worker processes
+    :returns: the list of (job, error) of the failed jobs. Jobs stopped by a
+    limit before reaching the duration are not failures, but are reported
+    """
+    for folder in set(f for job in jobs for f in job.get_folders()):
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+    failures = []
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_job, job) for job in jobs]
+        for done, future in enumerate(as_completed(futures), 1):
+            job, error, duration, status = future.result()
+            elapsed = time.time() - start
+            eta = elapsed / done * (len(jobs) - done)
+            if error is None:
+                stopped = ""
+                if status not in (None, sim.Sim.STATUS_COMPLETED):
+                    stopped = " (stopped early: %s)" % status
+                print("[%d/%d] %s done in %.1f s%s (elapsed %.0f s, eta %.0f s)" %
+                      (done, len(jobs), str(job), duration, stopped, elapsed, eta))
+            else:
+                failures.append((job, error))
+                print("[%d/%d] %s FAILED after %.1f s (elapsed %.0f s, eta %.0f s)" %
+                      (done, len(jobs), str(job), duration, elapsed, eta))
+            sys.stdout.flush()
+    return failures
+
+
+if __name__ == "__main__":
+    parser = OptionParser(usage="usage: %prog [options]",
+                          description="Runs all the simulations configured in the specified config file under the "
+                                      "specified section, for all the protocol and propagation settings, on a pool "
+                                      "of processes. Output files are written in one sub folder per setting of the "
+                                      "output folder")
+    parser.add_option("-c", "--config", dest="config", default="config.json", action="store",
+                      help="simulation config file [default: %default]")
+    parser.add_option("-s", "--section", dest="section", default="simulation", action="store",
+                      help="section inside configuration file [default: %default]")
+    parser.add_option("-o", "--output-folder", dest="output_folder", default="raw_data", action="store",
+                      help="base folder where output files are written [default: %default]")
+    parser.add_option("-j", "--jobs", dest="workers", default=os.cpu_count(), action="store", type="int",
+                      help="number of worker processes [default: number of cores, %default]")
+    parser.add_option("-S", "--scheduler", dest="scheduler", default=None, action="store",
+                      help="Scheduler used for the queue of events. Overrides the scheduler set in the config file.")
+    parser.add_option("--max-wall-time", dest="max_wall_time", default=None, action="store", type="float",
+                      metavar="SECONDS", help="stop each simulation after this number of seconds of real time, keeping "
+                                              "the output written so far. Overrides max_wall_time in the config file")
+    parser.add_option("--share-prefix", dest="share_prefix", default=False, action="store_true",
+                      help="simulate the part of the Simple Carrier Sensing runs that does not depend on the "
+                           "persistence only once per run and propagation model")
+    parser.add_option("-f", "--folders", dest="folders", default=None, action="store",
+                      help="comma separated list of the settings to simulate, by folder name [default: all]")
+
+    (options, args) = parser.parse_args()
+
+    settings = SETTINGS
+    if options.folders is not None:
+        names = options.folders.split(",")
+        unknown = [n for n in names if n not in [s.folder for s in SETTINGS]]
+        if len(unknown) > 0:
+            print("Unknown settings %s. Use some of %s" %
+                  (", ".join(unknown), ", ".join(s.folder for s in SETTINGS)))
+            sys.exit(1)
+        settings = [s for s in SETTINGS if s.folder in names]
+
+    jobs = expand_jobs(options.config, options.section, settings, options.output_folder, options.scheduler,
+                       options.share_prefix, options.max_wall_time)
+    print("Running %d simulations on %d processes" % (len(jobs), options.workers))
+    failures = run_sweep(jobs, options.workers)
+    if len(failures) > 0:
+        print("\n%d simulations failed:" % len(failures))
+        for job, error in failures:
+            print("%s:\n%s\n" % (str(job), error))
+        sys.exit(1)
+    print("All simulations completed")
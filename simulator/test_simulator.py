@@ -1,6 +1,23 @@
 from __future__ import absolute_import
 
+import gc
+import json
+import math
+import os
+import pickle
+import random
+import subprocess
+import sys
+
+import pytest
+
+import sim
+from config import parse_runs
+from scheduler import SCHEDULERS, create_scheduler
 from event import Event
+from log import Log
+from distribution import Distribution, BiasedExp, Buffered, poisson
+from tracefile import TraceStream, write_trace
 
 
 def test_time():
@@ -29,3 +46,470 @@ def test_equality():
     assert (not (smaller < larger))
     assert (not (larger > smaller))
     assert (smaller == larger)
+
+
+def test_cancel():
+    simulator = sim.Sim()
+    events = [Event(event_time=t, event_type=0, destination=0, source=0)
+              for t in range(200)]
+    for event in events:
+        simulator.schedule_event(event)
+    for event in events[:110]:
+        simulator.cancel_event(event)
+    # enough events have been canceled to trigger a compaction
+    assert (simulator.queue.entries() < len(events))
+    for event in events[110:]:
+        assert (simulator.next_event() == event)
+    assert (simulator.queue.canceled == 0)
+
+
+def test_schedulers():
+    # all schedulers must return events in exactly the same order
+    orders = []
+    for name in sorted(SCHEDULERS.keys()):
+        rng = random.Random(1)
+        queue = create_scheduler(name)
+        # the type of an event is the index of its delay. type 1 has a
+        # constant delay, while type 2 is wrongly declared as constant
+        queue.add_lane(1)
+        queue.add_lane(2)
+        order = []
+        first_id = Event.event_counter
+        now = 0
+        for i in range(5000):
+            # schedule a few events, some of them at exactly the same time
+            for _ in range(rng.randint(0, 2)):
+                delays = [0, 1e-6, rng.expovariate(1000)]
+                event_type = rng.randint(0, 2)
+                queue.schedule(Event(event_time=now + delays[event_type], event_type=event_type,
+                                     destination=0, source=0))
+            if rng.random() < 0.1 and len(queue) > 0:
+                queue.cancel(queue.peek())
+            event = queue.pop()
+            if event is not None:
+                assert (event.event_time >= now)
+                now = event.event_time
+                order.append(event.event_id - first_id)
+        orders.append(order)
+    for order in orders[1:]:
+        assert (order == orders[0])
+
+
+def test_parse_runs():
+    assert (parse_runs("3") == [3])
+    assert (parse_runs("0-3,7,9-10") == [0, 1, 2, 3, 7, 9, 10])
+
+
+def write_config(folder, **params):
+    """
+    Writes a small config file in folder, overriding its parameters with params
+    """
+    section = {
+        "seed": 0,
+        "duration": 0.2,
+        "range": 10,
+        "datarate": 8000000,
+        "queue": 2,
+        "interarrival": {"distribution": "exp", "lambda": 1000},
+        "size": {"distribution": "unif", "min": 32, "max": 1500, "int": 1},
+        "maxsize": 1500,
+        "processing": {"distribution": "const", "mean": 0.000001},
+        "nodes": [[[0, 0], [5, 0], [0, 5], [5, 5], [12, 0]]],
+        "output": "output_{seed}.csv",
+    }
+    section.update(params)
+    config_file = os.path.join(str(folder), "config.json")
+    with open(config_file, "w") as f:
+        json.dump({"simulation": section}, f)
+    return config_file
+
+
+def create_simulation(folder, config_file, protocol="simple", realistic=True, persistence=0.5, scheduler=None,
+                      setup=None):
+    """
+    Creates and initializes a simulation writing the output in folder. If
+    given, setup is called with the simulation before initializing it
+    """
+    simulator = sim.Sim()
+    simulator.set_config(config_file, "simulation", protocol, realistic, persistence, scheduler)
+    simulator.set_progress(sim.Sim.PROGRESS_NONE)
+    simulator.set_output_folder(str(folder))
+    if setup is not None:
+        setup(simulator)
+    simulator.initialize(0)
+    return simulator
+
+
+def read_output(folder):
+    """
+    Returns the content of the output file in folder
+    """
+    with open(os.path.join(str(folder), "output_0.csv")) as f:
+        return f.read()
+
+
+def run_simulation(folder, config_file, protocol="simple", checkpoint_interval=None, **options):
+    """
+    Runs a simulation writing the output in folder, returning its content.
+    options are passed to create_simulation()
+    """
+    simulator = create_simulation(folder, config_file, protocol, **options)
+    if checkpoint_interval is not None:
+        simulator.set_checkpoint(os.path.join(str(folder), "checkpoint"), checkpoint_interval)
+    simulator.run()
+    return read_output(folder)
+
+
+def test_checkpoint(tmp_path):
+    config_file = write_config(tmp_path)
+    output = run_simulation(tmp_path, config_file, checkpoint_interval=0.05)
+    # continuing from the last checkpoint must give the same output
+    simulator = sim.Sim.restore(os.path.join(str(tmp_path), "checkpoint"))
+    assert (0 < simulator.time < 0.2)
+    simulator.run()
+    assert (read_output(tmp_path) == output)
+
+
+def test_variants(tmp_path):
+    config_file = write_config(tmp_path)
+    folders = [tmp_path / p for p in ("p75", "p25")]
+    for f in folders:
+        f.mkdir()
+    # the shared prefix stops right before the first use of the persistence
+    prefix = create_simulation(folders[0], config_file, persistence=0.75).simulate_shared_prefix()
+    event = prefix.queue.peek()
+    assert (0 < prefix.time < 0.2 and event.destination.uses_persistence(event))
+    prefix.logger.close()
+    simulator = create_simulation(folders[0], config_file, persistence=0.75)
+    simulator.set_checkpoint(os.path.join(str(tmp_path), "checkpoint"), 0.05)
+    simulator.run_variants([(str(folders[0]), 0.75), (str(folders[1]), 0.25)], use_fork=False)
+    # each variant saves its own checkpoint
+    assert (all((f / "checkpoint").exists() for f in folders))
+    # each variant must give the same output as a separate run
+    for f, persistence in zip(folders, (0.75, 0.25)):
+        separate = tmp_path / ("separate_%s" % f.name)
+        separate.mkdir()
+        assert (read_output(f) == run_simulation(separate, config_file, persistence=persistence))
+
+
+def test_profiling(tmp_path, capsys):
+    config_file = write_config(tmp_path)
+    output = run_simulation(tmp_path, config_file)
+    simulator = create_simulation(tmp_path, config_file, setup=lambda s: s.set_profiling(True))
+    simulator.set_checkpoint(os.path.join(str(tmp_path), "checkpoint"), 0.05)
+    simulator.run()
+    # profiling must not change the output, and wrapped methods must survive
+    # checkpointing
+    assert (read_output(tmp_path) == output)
+    profiler = simulator.profiler
+    assert (sum(profiler.counts.values()) == simulator.events)
+    assert (profiler.timings["Channel.start_transmission"].calls > 0)
+    assert ("START_RX" in capsys.readouterr().out)
+    assert (sim.Sim.restore(os.path.join(str(tmp_path), "checkpoint")).profiler is not None)
+
+
+def test_gc_modes(tmp_path):
+    config_file = write_config(tmp_path)
+    output = run_simulation(tmp_path, config_file)
+    for gc_mode in (sim.Sim.GC_FREEZE, sim.Sim.GC_DISABLE):
+        simulator = create_simulation(tmp_path, config_file, setup=lambda s: s.set_gc_mode(gc_mode))
+        simulator.run()
+        assert (read_output(tmp_path) == output)
+        # processed events are kept for reuse
+        assert (len(simulator.event_pool) > 0)
+        assert (gc.isenabled())
+
+
+def test_limits(tmp_path):
+    config_file = write_config(tmp_path, max_events=1234)
+    simulator = create_simulation(tmp_path, config_file, "aloha", False, None)
+    assert (simulator.run() == sim.Sim.STATUS_EVENT_LIMIT)
+    assert (simulator.events == 1234)
+    assert (simulator.time < 0.2)
+    simulator = create_simulation(tmp_path, config_file, "aloha", False, None,
+                                  setup=lambda s: s.set_limits(max_events=10 ** 9))
+    assert (simulator.run() == sim.Sim.STATUS_COMPLETED)
+    assert (simulator.time > 0.2)
+
+
+def test_time_resolution(tmp_path):
+    config_file = write_config(tmp_path, time_resolution=1e9)
+    outputs = []
+    for scheduler in ["heap", "radix"]:
+        simulator = create_simulation(tmp_path, config_file, scheduler=scheduler)
+        simulator.run()
+        # all events happen at an integer number of nanoseconds
+        assert (round(simulator.time * 1e9) / 1e9 == simulator.time)
+        outputs.append(read_output(tmp_path))
+    assert (outputs[0] == outputs[1])
+
+
+def test_superposed_arrivals(tmp_path):
+    config_file = write_config(tmp_path, superposed_arrivals=True, duration=2)
+    simulator = create_simulation(tmp_path, config_file, "aloha", False, None)
+    assert (simulator.arrival_source is not None)
+    # a single arrival in the queue for the whole network
+    assert (len(simulator.queue) == 1)
+    simulator.run()
+    arrivals = {}
+    for line in read_output(tmp_path).splitlines()[1:]:
+        fields = line.split(",")
+        if int(fields[3]) == Log.LOG_GENERATED:
+            arrivals[fields[1]] = arrivals.get(fields[1], 0) + 1
+    # each node still receives about 1000 arrivals per second
+    assert (len(arrivals) == 5)
+    for count in arrivals.values():
+        assert (abs(count - 2000) < 5 * math.sqrt(2000))
+    # non exponential interarrival times fall back to per node arrivals
+    config_file = write_config(tmp_path, superposed_arrivals=True,
+                               interarrival={"distribution": "const", "mean": 0.001})
+    simulator = create_simulation(tmp_path, config_file, "aloha", False, None)
+    assert (simulator.arrival_source is None)
+    assert (len(simulator.queue) == 5)
+
+
+def test_poisson():
+    rng = random.Random(1)
+    for mean in [0.5, 4, 30, 500]:
+        values = [poisson(mean, rng) for _ in range(20000)]
+        average = sum(values) / len(values)
+        variance = sum((v - average) ** 2 for v in values) / len(values)
+        assert (abs(average - mean) < 5 * math.sqrt(mean / len(values)))
+        assert (abs(variance / mean - 1) < 0.05)
+
+
+def test_get_values():
+    configs = [
+        {"distribution": "const", "mean": 3},
+        {"distribution": "unif", "min": 32, "max": 1500, "int": 1},
+        {"distribution": "unif", "min": 0, "max": 1},
+        {"distribution": "exp", "lambda": 10},
+        {"distribution": "exp", "mean": 5, "int": 1},
+    ]
+    for config in configs:
+        # blocks of values and buffered streams return the same values as
+        # single draws
+        singles = Distribution(config, random.Random(1))
+        expected = [singles.get_value() for _ in range(100)]
+        assert (Distribution(config, random.Random(1)).get_values(100) == expected)
+        stream = Buffered(Distribution(config, random.Random(1)), 7)
+        assert ([next(stream) for _ in range(100)] == expected)
+
+
+def count_log_events(folder):
+    """
+    Returns the number of lines of the output file in folder, by event type
+    """
+    counts = {}
+    with open(os.path.join(str(folder), "output_0.csv")) as f:
+        for line in f.readlines()[1:]:
+            event = int(line.split(",")[3])
+            counts[event] = counts.get(event, 0) + 1
+    return counts
+
+
+def test_skip_blocked_arrivals(tmp_path):
+    results = []
+    for skip in [False, True]:
+        config_file = write_config(tmp_path, skip_blocked_arrivals=skip, duration=1, queue=1,
+                                   interarrival={"distribution": "exp", "lambda": 3000})
+        simulator = create_simulation(tmp_path, config_file, "aloha", False, None)
+        simulator.run()
+        results.append((simulator.events, count_log_events(tmp_path)))
+    # fewer events are processed, while arrivals and drops are the same up to
+    # statistical fluctuations
+    assert (results[1][0] < results[0][0])
+    # skipped arrivals are written when the queue frees up: the file is not
+    # sorted by time, but the arrivals of each node are
+    lines = [l.split(",") for l in read_output(tmp_path).splitlines()[1:]]
+    times = [float(l[0]) for l in lines]
+    assert (times != sorted(times))
+    for node in range(1, 6):
+        arrivals = [float(l[0]) for l in lines if int(l[1]) == node and int(l[3]) == Log.LOG_GENERATED]
+        assert (len(arrivals) > 0 and arrivals == sorted(arrivals))
+    for event in [Log.LOG_GENERATED, Log.LOG_QUEUE_DROPPED]:
+        expected = results[0][1][event]
+        assert (abs(results[1][1][event] - expected) < 5 * math.sqrt(expected))
+
+
+def test_buffered_variates(tmp_path):
+    config_file = write_config(tmp_path)
+    output = run_simulation(tmp_path, config_file)
+    config_file = write_config(tmp_path, buffered_variates=64)
+    buffered = run_simulation(tmp_path, config_file)
+    # values are drawn in a different order, but the simulation is still
+    # reproducible
+    assert (buffered != output)
+    assert (run_simulation(tmp_path, config_file) == buffered)
+
+
+def test_independent_streams(tmp_path):
+    def arrivals(output):
+        # arrivals of the first five nodes, with their sizes
+        lines = [line.split(",") for line in output.splitlines()[1:]]
+        return [l for l in lines if int(l[3]) == Log.LOG_GENERATED and int(l[1]) <= 5]
+    nodes = [[0, 0], [5, 0], [0, 5], [5, 5], [12, 0]]
+    outputs = {}
+    for independent in (False, True):
+        for extra in ([], [[20, 20]]):
+            config_file = write_config(tmp_path, nodes=[nodes + extra], independent_streams=independent)
+            outputs[independent, len(extra)] = arrivals(run_simulation(tmp_path, config_file))
+    # with independent streams, adding a node does not change the arrivals
+    # of the others
+    assert (outputs[True, 0] == outputs[True, 1])
+    assert (outputs[False, 0] != outputs[False, 1])
+
+
+def test_common_random_numbers(tmp_path):
+    def arrivals(output):
+        # arrivals within the duration: the last event processed depends on
+        # the protocol
+        lines = [l.split(",") for l in output.splitlines()[1:]]
+        return [l for l in lines if int(l[3]) == Log.LOG_GENERATED and float(l[0]) <= 0.2]
+    outputs = {}
+    for crn in ({}, {"common_random_numbers": True}, {"antithetic": True}):
+        for protocol in ("aloha", "simple"):
+            config_file = write_config(tmp_path, **crn)
+            outputs[str(crn), protocol] = arrivals(run_simulation(tmp_path, config_file, protocol))
+    # with common random numbers, the protocols see the same arrivals
+    assert (outputs["{}", "aloha"] != outputs["{}", "simple"])
+    for crn in ("{'common_random_numbers': True}", "{'antithetic': True}"):
+        assert (outputs[crn, "aloha"] == outputs[crn, "simple"])
+    assert (outputs["{'antithetic': True}", "aloha"] != outputs["{'common_random_numbers': True}", "aloha"])
+
+
+def test_importance_sampling(tmp_path):
+    class Accumulator:
+        log_weight = 0.0
+    # weighted by the likelihood ratio, biased values have the nominal
+    # distribution
+    accumulator = Accumulator()
+    biased = BiasedExp(0.5, 3, accumulator, random.Random(1))
+    weights = []
+    values = []
+    for _ in range(100000):
+        accumulator.log_weight = 0.0
+        values.append(biased.get_value())
+        weights.append(math.exp(accumulator.log_weight))
+    assert (abs(sum(weights) / len(weights) - 1) < 0.02)
+    assert (abs(sum(w * v for w, v in zip(weights, values)) / len(values) - 0.5) < 0.02)
+    config_file = write_config(tmp_path, arrival_bias=2, backoff_bias=0.5)
+    lines = run_simulation(tmp_path, config_file).splitlines()
+    assert (lines[0] == "time,src,dst,event,size,log_weight")
+    assert (len(set(line.split(",")[5] for line in lines[1:])) > 1)
+    # with buffered variates, biased values are still drawn one at a time, so
+    # that each logged weight covers exactly the values drawn so far
+    config_file = write_config(tmp_path, arrival_bias=2, backoff_bias=0.5, buffered_variates=True)
+    simulator = create_simulation(tmp_path, config_file)
+    for node in simulator.nodes:
+        assert (not isinstance(node.interarrival, Buffered) and not isinstance(node.backoff, Buffered))
+        assert (isinstance(node.size, Buffered))
+
+
+def test_trace_arrivals(tmp_path):
+    rng = random.Random(3)
+    arrivals = []
+    for node in range(5):
+        times = sorted(rng.uniform(0, 0.2) for _ in range(rng.randrange(0, 40)))
+        arrivals.append([(t, rng.randrange(32, 1500)) for t in times])
+    trace_file = os.path.join(str(tmp_path), "arrivals.trace")
+    write_trace(trace_file, arrivals)
+    # streams can be saved in checkpoints
+    stream = pickle.loads(pickle.dumps(TraceStream(trace_file, 1)))
+    assert (stream.get_interarrival() == arrivals[1][0][0])
+    # a trace written again is mapped again
+    write_trace(trace_file, arrivals[:1])
+    with pytest.raises(ValueError):
+        TraceStream(trace_file, 1)
+    write_trace(trace_file, arrivals)
+    assert (TraceStream(trace_file, 1).get_interarrival() == arrivals[1][0][0])
+    expected = [(node + 1, "%f" % t, size) for node in range(5) for t, size in arrivals[node]]
+    # with buffered variates, blocks do not go past the end of the trace
+    for buffered_variates in (False, True):
+        config_file = write_config(tmp_path, interarrival={"distribution": "trace", "file": trace_file},
+                                   buffered_variates=buffered_variates)
+        output = run_simulation(tmp_path, config_file, "aloha")
+        logged = [l.split(",") for l in output.splitlines()[1:]]
+        logged = [(int(l[1]), l[0], int(l[4])) for l in logged if int(l[3]) == Log.LOG_GENERATED]
+        assert (sorted(logged) == sorted(expected))
+
+
+def test_link_tables(tmp_path):
+    simulator = create_simulation(tmp_path, write_config(tmp_path), "aloha", persistence=None)
+    channel = simulator.channel
+    for node in simulator.nodes:
+        # the tables hold exactly the values computed for each transmission
+        for neighbor, delay, probability in channel.get_links(node):
+            distance = channel.distance(node, neighbor)
+            assert (delay == distance / channel.SOL)
+            assert (probability == 1 - pow(distance / channel.range, 1.0 / 3.0))
+
+
+def test_broadcast_rx(tmp_path):
+    outputs = []
+    events = []
+    for params in [{}, {"broadcast_rx": True}, {"broadcast_rx": True, "broadcast_quantum": 1e-7}]:
+        config_file = write_config(tmp_path, **params)
+        simulator = create_simulation(tmp_path, config_file)
+        simulator.run()
+        events.append(simulator.events)
+        outputs.append(read_output(tmp_path))
+    # grouping neighbors at exactly the same distance does not change the
+    # output, and a quantum groups all neighbors within range
+    assert (outputs[1] == outputs[0])
+    assert (events[2] < events[1] < events[0])
+
+
+def test_bulk_topology(tmp_path):
+    rng = random.Random(1)
+    # nodes on the borders of the grid cells and exactly at range distance
+    # as well, where rounding could make the methods disagree
+    positions = [[0, 0], [10, 0], [-10, 0], [0, 9.999999], [20, 20]]
+    positions += [[rng.uniform(-50, 50), rng.uniform(-50, 50)] for _ in range(200)]
+    simulator = create_simulation(tmp_path, write_config(tmp_path, nodes=[positions]), "aloha", persistence=None)
+    channel = simulator.channel
+    nodes = simulator.nodes
+    expected = [[n for n in nodes if n is not node and channel.distance(n, node) < channel.range]
+                for node in nodes]
+    assert ([channel.get_neighbors(node) for node in nodes] == expected)
+    # registering the nodes one at a time gives the same links
+    links = channel.links
+    channel.nodes = []
+    channel.links = {}
+    for node in nodes:
+        channel.register_node(node)
+    assert (channel.links == links)
+    # the grid and the pairwise distances find exactly the same links
+    pytest.importorskip("numpy")
+    assert (channel.pairwise_topology() == channel.grid_topology())
+
+
+def test_progress(tmp_path, capsys, monkeypatch):
+    config_file = write_config(tmp_path, duration=0.5)
+    run_simulation(tmp_path, config_file, "aloha", setup=lambda s: s.set_progress(sim.Sim.PROGRESS_BAR))
+    assert ("[====================] 100% (time = " in capsys.readouterr().out)
+    run_simulation(tmp_path, config_file, "aloha")
+    out = capsys.readouterr().out
+    assert ("[" not in out and "progress" not in out)
+    # -q is the same as --progress none
+    out = subprocess.check_output([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py"),
+                                   "-c", config_file, "-r", "0", "-p", "aloha", "-q"], cwd=str(tmp_path))
+    assert (b"[" not in out and b"progress" not in out)
+    # with a clock running at a given number of events per second, the clock
+    # is read about every PROGRESS_CHECK_PERIOD seconds after the first check.
+    # rates are powers of two, so that clock readings are exact
+    for events_per_second, interval in ((32768, 3276), (4096, 409)):
+        simulator = create_simulation(tmp_path, config_file, "aloha",
+                                      setup=lambda s: s.set_progress(sim.Sim.PROGRESS_LINES))
+        # report the progress at every check
+        simulator.PROGRESS_PERIOD = 0
+        with monkeypatch.context() as m:
+            m.setattr(sim.time, "time", lambda: simulator.events / events_per_second)
+            simulator.run()
+        lines = [l for l in capsys.readouterr().out.splitlines() if l.startswith("progress ")]
+        assert (lines[-1].startswith("progress run=0 time=0.500000 duration=0.500000 events=%d " %
+                                     simulator.events))
+        events = [int(l.split("events=")[1].split()[0]) for l in lines]
+        steps = [b - a for a, b in zip(events, events[1:])]
+        assert (steps[0] == sim.Sim.PROGRESS_FIRST_CHECK)
+        assert (min(2000, interval) == steps[1] and steps[2:-1] == [interval] * len(steps[2:-1]))
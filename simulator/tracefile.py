@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import
+from optparse import OptionParser
+import mmap
+import os
+import struct
+import sys
+
+
+class Trace:
+    """
+    Binary file of packet arrivals, with the arrival times and the packet
+    sizes of each node. The file is memory-mapped, and the arrivals of a node
+    are accessed through views of the mapped memory, so that only the pages
+    actually read are loaded. All values are little endian. The file starts
+    with a header and an index with one entry per node, followed by the data
+    of each node: arrival times as doubles, in seconds and in increasing
+    order, then sizes in bytes as unsigned 32 bit integers, padded to a
+    multiple of 8 bytes
+    """
+
+    MAGIC = b"ALTR"
+    VERSION = 1
+    # magic, version, number of nodes, padding
+    HEADER = struct.Struct("<4sIII")
+    # offset of the data of a node from the start of the file, and number of
+    # arrivals
+    ENTRY = struct.Struct("<QQ")
+
+    # traces opened so far, shared by all the nodes of a process. maps the
+    # absolute file name to a tuple (modification time, size, trace)
+    opened = {}
+
+    def __init__(self, file_name):
+        """
+        Opens a trace
+        :param file_name: name of the trace file
+        """
+        self.file_name = file_name
+        self.open()
+
+    @staticmethod
+    def get(file_name):
+        """
+        Returns a trace, opening it only the first time. If the file changed
+        since then, for example because it was written again between two runs,
+        it is mapped again, and the previous mapping is released when the
+        nodes using it are gone
+        :param file_name: name of the trace file
+        """
+        key = os.path.abspath(file_name)
+        stat = os.stat(key)
+        entry = Trace.opened.get(key)
+        if entry is None or entry[:2] != (stat.st_mtime_ns, stat.st_size):
+            entry = (stat.st_mtime_ns, stat.st_size, Trace(file_name))
+            Trace.opened[key] = entry
+        return entry[2]
+
+    def open(self):
+        """
+        Maps the file in memory and reads the index
+        """
+        if sys.byteorder != "little":
+            raise ValueError("Traces can only be read on little endian machines")
+        with open(self.file_name, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, nodes, _ = self.HEADER.unpack_from(self.map, 0)
+        if magic != self.MAGIC or version != self.VERSION:
+            raise ValueError("%s is not a trace file" % self.file_name)
+        self.index = [self.ENTRY.unpack_from(self.map, self.HEADER.size + i * self.ENTRY.size)
+                      for i in range(nodes)]
+
+    def __getstate__(self):
+        # the mapping is not saved in checkpoints: the file is mapped again
+        return {"file_name": self.file_name}
+
+    def __setstate__(self, state):
+        self.file_name = state["file_name"]
+        self.open()
+
+    def get_nodes_count(self):
+        """
+        Returns the number of nodes in the trace
+        """
+        return len(self.index)
+
+    def get_node(self, node):
+        """
+        Returns the arrivals of a node, as views of the mapped file
+        :param node: index of the node in the trace
+        :returns: a tuple (times, sizes) of memoryviews of doubles and of
+        unsigned integers
+        """
+        if node >= len(self.index):
+            raise ValueError("Trace %s has no arrivals for node %d" % (self.file_name, node))
+        offset, count = self.index[node]
+        data = memoryview(self.map)
+        times = data[offset:offset + 8 * count].cast("d")
+        sizes = data[offset + 8 * count:offset + 12 * count].cast("I")
+        return times, sizes
+
+
+class TraceStream:
+    """
+    Arrivals of a node read from a trace, one at a time. The stream is used
+    through two Distribution compatible objects: one returning the
+    interarrival times, and the other one the packet sizes, which must be
+    drawn in the same order
+    """
+
+    def __init__(self, file_name, node):
+        """
+        Constructor
+        :param file_name: name of the trace file
+        :param node: index of the node in the trace
+        """
+        self.trace = Trace.get(file_name)
+        self.node = node
+        # index of the next arrival, and time of the previous one
+        self.next_arrival = 0
+        self.next_size = 0
+        self.last_time = 0.0
+        self.times, self.sizes = self.trace.get_node(node)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # views are recreated when restoring
+        del state["times"]
+        del state["sizes"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.times, self.sizes = self.trace.get_node(self.node)
+
+    def get_interarrival(self):
+        """
+        Returns the time until the next arrival, or infinity if the trace is
+        over
+        """
+        if self.next_arrival >= len(self.times):
+            return float("inf")
+        time = self.times[self.next_arrival]
+        self.next_arrival += 1
+        interarrival = time - self.last_time
+        self.last_time = time
+        return interarrival
+
+    def get_size(self):
+        """
+        Returns the size of the next packet
+        """
+        size = self.sizes[self.next_size]
+        self.next_size += 1
+        return size
+
+
+class TraceInterarrival:
+    """
+    Interarrival times of a node read from a trace
+    """
+
+    def __init__(self, stream):
+        """
+        Constructor
+        :param stream: the TraceStream of the node
+        """
+        self.stream = stream
+
+    def get_value(self):
+        return self.stream.get_interarrival()
+
+    def get_values(self, n):
+        return [self.stream.get_interarrival() for _ in range(n)]
+
+
+class TraceSize:
+    """
+    Packet sizes of a node read from a trace
+    """
+
+    def __init__(self, stream):
+        """
+        Constructor
+        :param stream: the TraceStream of the node
+        """
+        self.stream = stream
+
+    def get_value(self):
+        return self.stream.get_size()
+
+    def get_values(self, n):
+        # sizes are only drawn for arrivals, so there are never more than
+        # the ones left in the trace
+        stream = self.stream
+        return [stream.get_size() for _ in range(min(n, len(stream.sizes) - stream.next_size))]
+
+
+def write_trace(file_name, arrivals):
+    """
+    Writes a trace file
+    :param file_name: name of the trace file
+    :param arrivals: list with, for each node, the list of (time, size) of
+    its arrivals, sorted by time
+    """
+    with open(file_name, "wb") as f:
+        f.write(Trace.HEADER.pack(Trace.MAGIC, Trace.VERSION, len(arrivals), 0))
+        offset = Trace.HEADER.size + len(arrivals) * Trace.ENTRY.size
+        for node in arrivals:
+            f.write(Trace.ENTRY.pack(offset, len(node)))
+            # times and sizes, padded to keep the times of the next node
+            # aligned
+            offset += (12 * len(node) + 7) // 8 * 8
+        for node in arrivals:
+            f.write(struct.pack("<%dd" % len(node), *[a[0] for a in node]))
+            f.write(struct.pack("<%dI" % len(node), *[int(a[1]) for a in node]))
+            f.write(b"\0" * ((8 - 4 * len(node) % 8) % 8))
+
+
+if __name__ == "__main__":
+    parser = OptionParser(usage="usage: %prog [options] INPUT OUTPUT",
+                          description="Converts a text trace into a binary trace file. Each line of the input file "
+                                      "has the index of the node (starting from 0), the arrival time in seconds and "
+                                      "the packet size in bytes, separated by commas")
+    (options, args) = parser.parse_args()
+    if len(args) != 2:
+        parser.print_help()
+        sys.exit(1)
+    nodes = []
+    with open(args[0]) as f:
+        for line in f:
+            if line.strip() == "":
+                continue
+            node, time, size = line.split(",")
+            node = int(node)
+            while len(nodes) <= node:
+                nodes.append([])
+            nodes[node].append((float(time), int(size)))
+    for node in nodes:
+        node.sort()
+    write_trace(args[1], nodes)